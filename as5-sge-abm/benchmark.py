@@ -0,0 +1,154 @@
+## Scaling benchmark for the SGE-ABM update step
+##
+## Times SGEModel.update() for a range of population sizes and antibiotic
+## modes with fixed seeds, and writes the results as JSON so that runs from
+## different commits can be compared:
+##
+##   python benchmark.py -o before.json
+##   python benchmark.py -o after.json --compare before.json
+##
+## The dish grows with the population (constant density of n_pop cells on a
+## 50 x 50 dish) unless --dish is given. Populations of 10^5 cells and more
+## should be run with the bacteria kept in spatial order, e.g.
+##
+##   python benchmark.py --sizes 1000000 --modes 1 --steps 5 --sort-period 5 --no-memory
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+import profiling
+import sge_model
+
+DEFAULTS = sge_model.SGEModel().get_parameters()
+
+
+def dish_size(n_pop, dish=None):
+    if dish is not None:
+        return dish
+    return DEFAULTS['x_size'] * np.sqrt(n_pop / DEFAULTS['n_pop'])
+
+
+def setup(n_pop, add_antibiotic, steps, seed, dish=None, sort_period=0):
+    size = dish_size(n_pop, dish)
+    model = sge_model.SGEModel(seed, n_pop=n_pop, add_antibiotic=add_antibiotic, x_size=size, y_size=size,
+                               sort_period=sort_period)
+    model.history_length = steps + 1
+    model.initialize()
+    return model
+
+
+def bench_case(n_pop, add_antibiotic, steps=20, warmup=2, seed=0, dish=None, memory=True, phases=False,
+               sort_period=0):
+    model = setup(n_pop, add_antibiotic, warmup + steps, seed, dish, sort_period)
+    for step in range(warmup):
+        model.update()
+    cells = 0
+    elapsed = 0.0
+    for step in range(steps):
+        cells += len(model.bacteria)
+        start = time.perf_counter()
+        model.update()
+        elapsed += time.perf_counter() - start
+
+    result = {
+        'n_pop': n_pop,
+        'add_antibiotic': add_antibiotic,
+        'dish': model.x_size,
+        'sort_period': sort_period,
+        'steps': steps,
+        'mean_cells': cells / steps,
+        'seconds_per_step': elapsed / steps,
+        'seconds_per_cell_step': elapsed / max(cells, 1),
+    }
+
+    if phases:  # separate run, the per-phase timers add their own overhead
+        model = setup(n_pop, add_antibiotic, warmup + steps, seed, dish, sort_period)
+        for step in range(warmup):
+            model.update()
+        model.profiler = profiling.PhaseProfiler()
+        for step in range(steps):
+            model.update()
+        result['phase_seconds_per_step'] = model.profiler.mean_seconds()
+
+    if memory:  # second, identical run under tracemalloc so its overhead does not skew the timings
+        tracemalloc.start()
+        model = setup(n_pop, add_antibiotic, warmup + steps, seed, dish, sort_period)
+        for step in range(warmup + steps):
+            model.update()
+        result['peak_memory_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):  # print the time per step of every case relative to a baseline file
+    old = {(r['n_pop'], r['add_antibiotic']): r for r in baseline['results']}
+    print('%8s %4s %14s %14s %8s' % ('n_pop', 'mode', 'before ms/step', 'after ms/step', 'ratio'))
+    for r in results:
+        key = (r['n_pop'], r['add_antibiotic'])
+        if key in old:
+            before = old[key]['seconds_per_step']
+            print('%8d %4d %14.3f %14.3f %8.2f' % (key + (1000 * before, 1000 * r['seconds_per_step'],
+                                                          r['seconds_per_step'] / before)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the SGE-ABM update step.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[50, 500, 5000, 50000, 100000],
+                        help='initial population sizes')
+    parser.add_argument('--modes', type=int, nargs='+', default=[0, 1, 2], help='add_antibiotic values')
+    parser.add_argument('--steps', type=int, default=20, help='timed update() steps per case')
+    parser.add_argument('--warmup', type=int, default=2, help='untimed steps before timing')
+    parser.add_argument('--seed', type=int, default=0, help='seed of every case')
+    parser.add_argument('--dish', type=float, default=None, help='fixed dish side instead of constant density')
+    parser.add_argument('--sort-period', type=int, default=0, metavar='K',
+                        help='reorder the bacteria by position every K steps (SGEModel.sort_period)')
+    parser.add_argument('--no-memory', action='store_true', help='skip the peak memory measurement')
+    parser.add_argument('--phases', action='store_true', help='also record the mean time of every update() phase')
+    parser.add_argument('--compare', metavar='FILE', help='earlier results to compare against')
+    parser.add_argument('-o', '--output', default='sge-abm-benchmark.json', help='output JSON file')
+    args = parser.parse_args(argv)
+
+    results = []
+    for n_pop in args.sizes:
+        for mode in args.modes:
+            result = bench_case(n_pop, mode, args.steps, args.warmup, args.seed, args.dish, not args.no_memory,
+                                args.phases, args.sort_period)
+            results.append(result)
+            print('n_pop=%d add_antibiotic=%d: %.3f ms/step, %.2f us/cell-step' % (
+                n_pop, mode, 1000 * result['seconds_per_step'], 1e6 * result['seconds_per_cell_step']), flush=True)
+
+    report = {
+        'commit': git_commit(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'machine': platform.platform(),
+        'settings': vars(args),
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=1)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
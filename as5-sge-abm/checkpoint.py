@@ -0,0 +1,96 @@
+## Checkpoint and resume for SGE-ABM runs
+##
+## save() dumps the complete state of an SGEModel -- bacteria and antibiotic
+## arrays, the antibiotic field if there is one, the recorded statistics
+## (scalar series and the latest histograms, all that is kept of them), time,
+## parameters and the state of the random number generator -- into one .npz
+## file; load() puts it back so that the run continues exactly as if it had
+## never stopped. The state is written as plain arrays (no pickling) to a
+## temporary file that then replaces the target, so a run killed while
+## writing still leaves the previous checkpoint intact.
+## KD-trees are not saved, the model rebuilds them on first use.
+
+import json
+import os
+
+import numpy as np
+
+from concentration_field import ConcentrationField
+from population_stats import Histogram, PopulationStats
+import sge_model
+
+
+def save(model, path, extra=None, compress=False):
+    # extra: JSON-serialisable data stored alongside, returned by load()
+    meta = {
+        'time': model.time,
+        'params': model.get_parameters(),  # current values, e.g. as changed in the GUI
+        'history_length': model.history_length,
+        'next_id': int(model.bacteria.next_id),
+        'rng': model.rng.bit_generator.state,
+        'stats': {name: [column, hist.low, hist.high, hist.nbins]
+                  for name, (column, hist) in model.stats.quantities.items()},
+        'extra': extra,
+    }
+    arrays = {'meta': np.array(json.dumps(meta))}
+    for name in model.bacteria.columns:
+        arrays['bacteria_' + name] = model.bacteria.data[name][:len(model.bacteria)]
+    for name in model.antibiotics.columns:
+        arrays['antibiotics_' + name] = model.antibiotics.data[name][:len(model.antibiotics)]
+    for name, buffer in model.stats.buffers().items():
+        arrays['stats_' + name] = buffer.values()
+    for name, counts in model.stats.hists.items():
+        arrays['stats_hist_' + name] = counts
+    if model.field is not None:
+        arrays['field'] = model.field.values
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        (np.savez_compressed if compress else np.savez)(f, **arrays)
+    os.replace(tmp_path, path)
+
+
+def load(path, history_length=None):
+    # model restored from a checkpoint, and the extra data given to save();
+    # history_length can enlarge the recorded history, e.g. for a longer run than first planned
+    with np.load(path) as f:
+        arrays = {name: f[name] for name in f.files}
+    meta = json.loads(str(arrays['meta']))
+
+    model = sge_model.SGEModel(**meta['params'])
+    model.history_length = max(meta['history_length'], history_length or 0)
+    model.time = meta['time']
+
+    rng = np.random.default_rng()
+    if type(rng.bit_generator).__name__ != meta['rng']['bit_generator']:
+        rng = np.random.Generator(getattr(np.random, meta['rng']['bit_generator'])())
+    rng.bit_generator.state = meta['rng']
+    model.rng = rng
+
+    model.bacteria = restore_store(sge_model.Bacteria, arrays, 'bacteria_')
+    model.bacteria.next_id = meta['next_id']
+    model.antibiotics = restore_store(sge_model.Antibiotics, arrays, 'antibiotics_')
+    model.bacteria_tree = None
+    model.antibiotics_tree = None
+    model.field = None
+    if 'field' in arrays:
+        model.field = ConcentrationField(model.x_size, model.y_size, model.field_spacing)
+        model.field.values = arrays['field'].copy()
+
+    model.stats = PopulationStats({name: (column, Histogram(low, high, nbins))
+                                   for name, (column, low, high, nbins) in meta['stats'].items()},
+                                  history=model.history_length)
+    for name, buffer in model.stats.buffers().items():
+        buffer.extend(arrays['stats_' + name])
+    for name in model.stats.hists:
+        model.stats.hists[name] = arrays['stats_hist_' + name].copy()
+    return model, meta['extra']
+
+
+def restore_store(store_class, arrays, prefix):
+    columns = {name: arrays[prefix + name] for name in store_class.columns}
+    size = len(columns[next(iter(columns))])
+    store = store_class(capacity=max(64, 2 * size))
+    if size > 0:
+        store.append(**columns)
+    return store
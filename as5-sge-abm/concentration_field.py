@@ -0,0 +1,105 @@
+## Antibiotic concentration field for the SGE-ABM model
+##
+## Alternative to discrete antibiotic molecules (SGEModel.antibiotic_field = 1):
+## the antibiotic is a concentration, in molecules per unit area, on a square
+## lattice over the dish. Doses are deposited as molecules at lattice sites.
+## Every step the field diffuses with no-flux walls and decays by a constant
+## fraction. Diffusion is solved exactly for the 5-point lattice Laplacian in
+## the cosine basis (a DCT diagonalizes it for reflecting walls), so a step
+## costs two transforms whatever the diffusion coefficient, with no stability
+## limit on the step size.
+##
+## The kill disc of a cell is the set of lattice sites within kill_radius of
+## its site, and m the molecules on them. Taking the molecules as Poisson
+## distributed, the chance that at least one is within reach, and kills a
+## susceptible cell, is 1 - exp(-m); m of every site comes from one pass of
+## shifted sums over the lattice, so it is an array lookup per cell. A kill
+## consumes one molecule, taken from the disc in proportion to what each site
+## holds; a disc with less than one takes the rest from the nearest sites
+## beyond it, and a dish with less than one molecule left kills no more.
+
+import numpy as np
+
+
+class ConcentrationField:
+    def __init__(self, width, height, spacing=1.0):
+        self.spacing = float(spacing)
+        self.values = np.zeros((max(int(np.ceil(width / spacing)), 1), max(int(np.ceil(height / spacing)), 1)))
+        self.factors = {}  # (diffusion coefficient, decay) -> per-mode factor of one step
+
+    def sites(self, x, y):  # lattice indices of positions, positions on the far walls belong to the last site
+        ix = np.minimum((np.asarray(x) / self.spacing).astype(np.int64), self.values.shape[0] - 1)
+        iy = np.minimum((np.asarray(y) / self.spacing).astype(np.int64), self.values.shape[1] - 1)
+        return ix, iy
+
+    def at(self, x, y):  # concentration at the given positions
+        return self.values[self.sites(x, y)]
+
+    def deposit(self, x, y, molecules=1.0):  # add molecules at the given positions
+        np.add.at(self.values, self.sites(x, y), molecules / self.spacing**2)
+
+    def disc_masses(self, radius):  # molecules within radius of every site, on the sites of its disc
+        reach = int(radius / self.spacing)
+        nx, ny = self.values.shape
+        padded = np.pad(self.values, reach)
+        masses = np.zeros_like(self.values)
+        for dx in range(-reach, reach + 1):
+            for dy in range(-reach, reach + 1):
+                if (dx * dx + dy * dy) * self.spacing**2 <= radius**2:
+                    masses += padded[reach + dx:reach + dx + nx, reach + dy:reach + dy + ny]
+        return masses * self.spacing**2
+
+    def window(self, ix, iy, reach):  # view on the sites at most reach sites away from site (ix, iy), squared distances
+        nx, ny = self.values.shape
+        xs = slice(max(ix - reach, 0), min(ix + reach + 1, nx))
+        ys = slice(max(iy - reach, 0), min(iy + reach + 1, ny))
+        dist2 = ((np.arange(xs.start, xs.stop)[:, None] - ix)**2 +
+                 (np.arange(ys.start, ys.stop)[None, :] - iy)**2) * self.spacing**2
+        return self.values[xs, ys], dist2
+
+    def disc_mass(self, x, y, radius):  # molecules within radius of the site of one position
+        ix, iy = self.sites(x, y)
+        values, dist2 = self.window(ix, iy, int(radius / self.spacing))
+        return values[dist2 <= radius**2].sum() * self.spacing**2
+
+    def consume(self, x, y, radius, molecules=1.0):
+        # take molecules from the sites within radius of the site of (x, y), in proportion to what each
+        # holds; if they hold fewer, the disc grows to the nearest sites beyond until it holds enough;
+        # False, and nothing taken, if the whole dish holds fewer
+        area = self.spacing**2
+        if self.total() < molecules:
+            return False
+        ix, iy = self.sites(x, y)
+        nx, ny = self.values.shape
+        reach = int(radius / self.spacing) + 1
+        while True:
+            values, dist2 = self.window(ix, iy, reach)
+            whole_dish = values.shape == self.values.shape
+            order = np.argsort(dist2, axis=None)
+            held = np.cumsum(values.ravel()[order]) * area  # molecules on the nearest sites
+            k = np.searchsorted(held, molecules)
+            if k < len(order) and (dist2.ravel()[order[k]] <= (reach * self.spacing)**2 or whole_dish):
+                # every site up to that distance is in the window, a larger disc may hold more than needed
+                disc = dist2 <= max(dist2.ravel()[order[k]], radius**2)
+            elif whole_dish:
+                disc = np.ones(values.shape, dtype=bool)  # the total, by rounding, just reaches molecules
+            else:
+                reach = 2 * reach
+                continue
+            values[disc] *= max(1 - molecules / (values[disc].sum() * area), 0)
+            return True
+
+    def step(self, diffusion_coef, decay=0.0):  # one time step of diffusion and decay
+        from scipy import fft  # imported on first use, like the KD-tree
+        key = (diffusion_coef, decay)
+        if key not in self.factors:
+            nx, ny = self.values.shape
+            # eigenvalues of the lattice Laplacian with reflecting walls, one per cosine mode
+            lx = (2 - 2 * np.cos(np.pi * np.arange(nx) / nx)) / self.spacing**2
+            ly = (2 - 2 * np.cos(np.pi * np.arange(ny) / ny)) / self.spacing**2
+            self.factors[key] = np.exp(-diffusion_coef * (lx[:, None] + ly[None, :])) * (1 - decay)
+        self.values = fft.idctn(fft.dctn(self.values, norm='ortho') * self.factors[key], norm='ortho')
+        np.maximum(self.values, 0, out=self.values)  # rounding can leave tiny negative values
+
+    def total(self):  # number of molecules on the dish
+        return self.values.sum() * self.spacing**2
@@ -0,0 +1,209 @@
+## Persistent-artist rendering of the SGE-ABM model
+##
+## Dashboard lays out the seven panels of the simulator window once and keeps
+## their artists: the petri dish scatter plots and antibiotic field image, the
+## time series lines and the histograms. Every frame only their data is
+## replaced (scatter offsets and colours, line data, histogram heights), and
+## on canvases that support it the changed panels are blitted onto a saved
+## background instead of redrawing the figure:
+##
+##   dashboard = Dashboard()
+##   dashboard.draw(model, fig)  # every frame
+##
+## Time series are thinned to at most max_points points, and axis limits grow
+## in steps (a full redraw happens only then), so the cost of a frame does not
+## depend on the length of the history. The figure is laid out again when it
+## changes or when parameters that fix the layout (dish size, lifetime,
+## maximal protein production, field lattice) change.
+
+import numpy as np
+import matplotlib.colors as colors
+from matplotlib.gridspec import GridSpec
+from matplotlib.patches import Polygon
+
+
+class Dashboard:
+    def __init__(self, max_points=1000):
+        self.max_points = max_points  # longest line drawn per series
+        self.fig = None
+        self.key = None  # parameters the layout was built for
+        self.draw_cid = None
+        self.backgrounds = {}  # axes -> saved pixels without the animated artists
+
+    def draw(self, model, fig):
+        key = layout_key(model)
+        if fig is not self.fig or key != self.key:
+            self.build(model, fig, key)
+            self.update(model)
+            fig.canvas.draw()
+        elif self.update(model) or not supports_blit(fig.canvas):
+            fig.canvas.draw()  # limits changed, the static parts are out of date
+        else:
+            self.blit()
+
+    def build(self, model, fig, key):
+        if self.fig is not None and self.draw_cid is not None:
+            self.fig.canvas.mpl_disconnect(self.draw_cid)
+        self.fig, self.key = fig, key
+        self.max_prot = key[3]
+        fig.clear()
+        gs = GridSpec(nrows=3, ncols=3, figure=fig)
+        self.artists = {}  # axes -> artists updated every frame
+        self.limits = {}  # axes -> current (x limits, y limits) of the growing panels
+
+        def animated(ax, artist):
+            artist.set_animated(True)  # left out of full draws, so the saved background stays empty
+            self.artists.setdefault(ax, []).append(artist)
+            return artist
+
+        ax = self.petri_ax = fig.add_subplot(gs[:, 0])
+        self.field_image = animated(ax, ax.imshow(np.zeros((1, 1)), origin='lower', cmap='Reds', alpha=0.5,
+                                                  aspect='auto', extent=(0, model.x_size, 0, model.y_size)))
+        self.cells = animated(ax, ax.scatter([], [], c=[], cmap='Blues',
+                                             norm=colors.Normalize(vmin=0, vmax=self.max_prot)))
+        self.molecules = animated(ax, ax.scatter([], [], color='red', s=1))
+        self.kill_areas = animated(ax, ax.scatter([], [], facecolors='none', edgecolors='r', alpha=0.1))
+        ax.set_xlim(-1, model.x_size + 1)
+        ax.set_ylim(-1, model.y_size + 1)
+        ax.set_xlabel('x')
+        ax.set_ylabel('y')
+        ax.set_title('Petri dish of E. coli and carbenicillin')
+
+        self.series_lines = {}  # series name -> line
+        self.series_axes = []
+        self.doses = {}  # axes -> line of the dose markers, one path broken by nan
+        for position, names, ylabel, doses in (((0, 1), ['cell_counts'], 'cell count', True),
+                                               ((0, 2), ['prot_means', 'prot_low', 'prot_high'], 'protein count', True),
+                                               ((2, 2), ['age_means', 'age_low', 'age_high'], 'age', False)):
+            ax = fig.add_subplot(gs[position])
+            for name in names:
+                if name.endswith(('_low', '_high')):  # mean -+ standard deviation
+                    self.series_lines[name] = animated(ax, ax.plot([], [], color='C0', alpha=0.5)[0])
+                else:
+                    self.series_lines[name] = animated(ax, ax.plot([], [], label='mean')[0])
+            if doses:
+                self.doses[ax] = animated(ax, ax.plot([], [], color='red', alpha=0.5,
+                                                      transform=ax.get_xaxis_transform())[0])
+            if len(names) > 1:
+                ax.legend(loc='upper left')  # fixed, 'best' would move with the data and leave the background stale
+            ax.set_xlabel('time')
+            ax.set_ylabel(ylabel)
+            self.series_axes.append(ax)
+            self.limits[ax] = None
+
+        self.hist_steps = {}  # statistics name -> (bin edges, filled step outline)
+        for position, name, xmax, xlabel in (((1, 1), 'prot', self.max_prot, 'protein count'),
+                                             ((2, 1), 'age', model.lifetime, 'age'),
+                                             ((1, 2), 'mrna', 105, 'mRNA count')):
+            ax = fig.add_subplot(gs[position])
+            edges, counts = model.stats.histogram(name)
+            outline = Polygon(step_outline(edges, np.zeros(len(edges) - 1)), closed=True, facecolor='C0')
+            self.hist_steps[name] = (edges, animated(ax, ax.add_patch(outline)))
+            ax.set_xlim(0, xmax)
+            ax.set_xlabel(xlabel)
+            ax.set_ylabel('cell count')
+            self.limits[ax] = None
+
+        self.draw_cid = fig.canvas.mpl_connect('draw_event', self.on_draw)
+
+    def update(self, model):  # replace the data of all artists, True if an axis range had to change
+        bacteria, antibiotics = model.bacteria, model.antibiotics
+        self.cells.set_offsets(np.column_stack((bacteria.x, bacteria.y)))
+        self.cells.set_array(bacteria.prot_count)  # brightness from marA expression
+        offsets = np.column_stack((antibiotics.x, antibiotics.y))
+        self.molecules.set_offsets(offsets)
+        self.kill_areas.set_offsets(offsets)
+        self.kill_areas.set_sizes([model.effective_kill_radius() * 400])
+        if model.field is not None:
+            self.field_image.set_data(model.field.values.T)
+            self.field_image.set_clim(0, max(model.field.values.max(), 1e-12))
+        self.field_image.set_visible(model.field is not None)
+
+        rescaled = False
+        series = model.stats.series()
+        times = series['time']
+        step = max(1, -(-len(times) // self.max_points))  # counted from the end, so the latest step is always shown
+        shown = {'cell_counts': series['cell_counts']}
+        for name in ('prot', 'age'):
+            means, stds = series[name + '_means'], series[name + '_stds']
+            shown[name + '_means'], shown[name + '_low'], shown[name + '_high'] = means, means - stds, means + stds
+        for name, line in self.series_lines.items():
+            line.set_data(times[::-step][::-1], shown[name][::-step][::-1])
+        doses = np.repeat(np.asarray(dose_times(model, times), dtype=np.float64), 3)
+        heights = np.tile([0, 1, np.nan], len(doses) // 3)
+        for markers in self.doses.values():
+            markers.set_data(doses, heights)
+
+        for ax in self.series_axes:
+            rescaled |= self.fit(ax, times, np.concatenate([line.get_ydata() for line in ax.lines
+                                                             if line not in self.doses.values()]))
+        for name, (edges, patch) in self.hist_steps.items():
+            counts = model.stats.histogram(name)[1]
+            patch.set_xy(step_outline(edges, counts))
+            rescaled |= self.fit(patch.axes, None, counts)
+        return rescaled
+
+    def fit(self, ax, times, values):
+        # grow the limits of a panel in steps so that a full redraw is rarely needed;
+        # they also shrink, e.g. after a reset, once the data fills less than a quarter of them
+        values = np.asarray(values, dtype=np.float64)
+        values = values[np.isfinite(values)]
+        low = min(values.min(), 0) if len(values) > 0 else 0
+        high = max(values.max(), 1) if len(values) > 0 else 1
+        xlim = ax.get_xlim()
+        if times is not None:
+            start, end = (times[0], max(times[-1], times[0] + 1)) if len(times) > 0 else (0, 1)
+            if self.limits[ax] is None or start < xlim[0] or end > xlim[1] or end - start < (xlim[1] - start) / 4:
+                xlim = (start, start + 1.5 * (end - start))
+        ylim = ax.get_ylim()
+        if self.limits[ax] is None or low < ylim[0] or high > ylim[1] or high - low < (ylim[1] - ylim[0]) / 4:
+            ylim = (1.5 * low, 1.5 * high)
+        if (xlim, ylim) == self.limits[ax]:
+            return False
+        if times is not None:
+            ax.set_xlim(xlim)
+        ax.set_ylim(ylim)
+        self.limits[ax] = (ax.get_xlim(), ax.get_ylim())
+        return True
+
+    def on_draw(self, event):  # after a full draw: save the backgrounds, then draw the animated artists on them
+        canvas = self.fig.canvas
+        if canvas.is_saving():
+            return  # savefig() draws the animated artists itself
+        self.backgrounds = {ax: canvas.copy_from_bbox(region(ax)) for ax in self.artists} if supports_blit(canvas) else {}
+        for ax, artists in self.artists.items():
+            for artist in artists:
+                ax.draw_artist(artist)
+
+    def blit(self):  # redraw the animated artists of every panel on its background
+        canvas = self.fig.canvas
+        for ax, artists in self.artists.items():
+            canvas.restore_region(self.backgrounds[ax])
+            for artist in artists:
+                ax.draw_artist(artist)
+            canvas.blit(region(ax))
+
+
+def supports_blit(canvas):  # the attribute is missing before Matplotlib 3.4
+    return getattr(canvas, 'supports_blit', hasattr(canvas, 'copy_from_bbox') and hasattr(canvas, 'restore_region'))
+
+
+def step_outline(edges, counts):  # closed outline of a histogram drawn as steps on the x axis
+    return np.column_stack((np.repeat(edges, 2), np.concatenate(([0], np.repeat(counts, 2), [0]))))
+
+
+def region(ax):  # pixels an animated artist of the panel can touch, antialiasing reaches past the clip box
+    return ax.bbox.padded(2)
+
+
+def layout_key(model):  # what the layout depends on, it is built again when this changes
+    max_prot = model.mrna_synth_rate * model.prot_activ_prob * model.prot_synth_prob * model.lifetime
+    shape = model.field.values.shape if model.field is not None else None
+    return model.x_size, model.y_size, model.lifetime, max_prot, shape
+
+
+def dose_times(model, times):  # steps at which antibiotics were added within the recorded times
+    if model.add_antibiotic == 0 or len(times) == 0:
+        return []
+    first = max(model.intro_period, times[0] + -times[0] % model.intro_period)
+    return range(first, times[-1] + 1, model.intro_period)
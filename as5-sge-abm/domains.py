@@ -0,0 +1,356 @@
+## Domain decomposition of the petri dish over worker processes
+##
+## The dish is cut into vertical strips of equal width, and each strip is
+## simulated by an SGEModel in a worker process of its own. The coordinator
+## (the calling process) drives the steps of all workers in lockstep and
+## passes data between neighbouring strips:
+##
+##   halo         cells within halo_width(model) of a strip edge are sent to the
+##                neighbour, which avoids them like its own cells
+##                (SGEModel.halo_points); the move targets of the left
+##                neighbour take precedence over local ones
+##                (SGEModel.halo_targets), so cells are ranked by strip and
+##                then by row, just as rows are ranked in a single process
+##   antibiotics  dosed by the coordinator and replicated in every worker, so
+##                kill checks need no halo; a molecule used in any strip is
+##                cleared in all of them
+##   migrants     cells that moved or were born across an edge change owner
+##                at the end of the step
+##
+## Offspring are placed by the parent's strip, at most 5 divide_rad_std past
+## its edges (SGEModel.halo_range). Two offspring placed closer than
+## min_dist on both sides of an edge in the same step are resolved in favour
+## of the left strip; the right one is dropped as if that division had
+## failed. Otherwise every rule is that of SGEModel.update(), so the
+## population statistics match the single-process model. Each strip has its
+## own random stream, so a run does not reproduce a single-process run with
+## the same seed, but it does reproduce itself for a fixed number of domains.
+##
+##   python domains.py --domains 4 --steps 100 --seed 1 --set n_pop=1000000 \
+##       --set x_size=7071 --set y_size=7071 --set sort_period=5 -o run.npz
+##
+## writes the same .npz file as headless.py.
+
+import argparse
+import multiprocessing
+import traceback
+
+import numpy as np
+
+import headless
+import sge_model
+
+
+def halo_width(model):  # how far past a strip edge the cells of the neighbour are needed
+    return offspring_reach(model) + model.min_dist + model.move_rad
+
+
+def offspring_reach(model):  # offspring further than this from the parent's strip are not placed
+    return 5 * model.divide_rad_std
+
+
+def columns(store, rows=slice(None)):  # copy of the given rows of an agent store as column name -> array
+    return {name: getattr(store, name)[rows].copy() for name in store.columns}
+
+
+def concat(parts):  # merge a list of column dicts
+    parts = [part for part in parts if part is not None]
+    return {name: np.concatenate([part[name] for part in parts]) for name in parts[0]} if parts else None
+
+
+class Domain:
+    # one strip of the dish, simulated by an SGEModel in a worker process;
+    # the methods are the commands of one step, called by Domains in this order
+    def __init__(self, index, n_domains, params, seed, cells, next_id):
+        self.index = index
+        self.n_domains = n_domains
+        self.last = index == n_domains - 1
+        self.model = sge_model.SGEModel(seed, **params)
+        self.model.history_length = 1  # only the coordinator records statistics
+        self.width = self.model.x_size / n_domains
+        self.x0 = index * self.width
+        self.x1 = self.x0 + self.width
+
+        self.model.n_pop = 0
+        self.model.initialize()
+        self.model.n_pop = params['n_pop']
+        if len(cells['x']) > 0:
+            self.model.bacteria.append(**cells)
+        self.model.bacteria.next_id = next_id
+        if self.model.sort_period:
+            self.model.sort_bacteria()
+        self.n = 0
+
+    def edges(self, points):  # masks of the points near the left and the right edge (none at the dish border)
+        x = points[:, 0] if points.ndim == 2 else points
+        width = halo_width(self.model)
+        left = (x < self.x0 + width) if self.index > 0 else np.zeros(len(x), dtype=bool)
+        right = (x >= self.x1 - width) if not self.last else np.zeros(len(x), dtype=bool)
+        return left, right
+
+    def partial(self):
+        return self.model.stats.partial(self.model.bacteria)
+
+    def begin(self, dose):  # dosing, gene expression and move targets; returns the halo for the move
+        if dose is not None:
+            self.model.antibiotics.append(**dose)
+            self.model.antibiotics_tree = None
+        if self.model.sort_period and self.model.time % self.model.sort_period == 0:
+            self.model.sort_bacteria()
+        self.model.biosynth_all()
+
+        self.n = len(self.model.bacteria)
+        self.targets = self.model.move_targets(self.n)
+        points = np.column_stack((self.model.bacteria.x, self.model.bacteria.y))
+        left, right = self.edges(points)
+        return ({'points': points[left], 'targets': self.targets[left]},
+                {'points': points[right], 'targets': self.targets[right]})
+
+    def move(self, from_left, from_right):  # returns the halo for division
+        self.model.halo_points = np.concatenate((from_left['points'], from_right['points']))
+        self.model.halo_targets = from_left['targets']  # cells of the left strip rank lower
+        self.model.bacteria_tree = None
+        self.model.move(self.n, self.targets)
+        self.model.halo_targets = None
+
+        points = np.column_stack((self.model.bacteria.x, self.model.bacteria.y))
+        left, right = self.edges(points)
+        return points[left], points[right]
+
+    def divide(self, from_left, from_right):  # returns the offspring that may collide with the right strip's
+        self.model.halo_points = np.concatenate((from_left, from_right))
+        reach = offspring_reach(self.model)
+        self.model.halo_range = (self.x0 - reach if self.index > 0 else -np.inf, self.x1 + reach if not self.last else np.inf)
+        self.model.bacteria_tree = None
+        self.model.divide(self.n)
+        self.model.halo_points = self.model.halo_range = None
+        self.model.bacteria_tree = None
+
+        newborn = np.column_stack((self.model.bacteria.x[self.n:], self.model.bacteria.y[self.n:]))
+        return newborn[self.edges(newborn)[1]]
+
+    def survive(self, left_offspring):  # returns the antibiotics used here and the cells leaving the strip
+        if len(left_offspring) > 0 and len(self.model.bacteria) > self.n:
+            newborn = np.column_stack((self.model.bacteria.x[self.n:], self.model.bacteria.y[self.n:]))
+            i, j = sge_model.close_pairs(newborn, left_offspring, self.model.min_dist)
+            keep = np.ones(len(self.model.bacteria), dtype=bool)
+            keep[self.n + i] = False
+            self.model.bacteria.compact(keep)
+            self.model.bacteria_tree = None
+
+        self.model.check_survival(self.n)
+        self.model.clear_bacteria()
+
+        owner = np.minimum((self.model.bacteria.x // self.width).astype(np.int64), self.n_domains - 1)
+        leaving = owner != self.index
+        emigrants = columns(self.model.bacteria, leaving) if leaving.any() else None
+        if emigrants is not None:
+            self.model.bacteria.compact(~leaving)
+            self.model.bacteria_tree = None
+        return self.model.antibiotics.used.copy(), emigrants
+
+    def end(self, used, immigrants):  # returns the statistics partial of the strip
+        self.model.antibiotics.used[:] |= used
+        self.model.clear_antibiotics()
+        if immigrants is not None:
+            self.model.bacteria.append(**immigrants)
+            self.model.bacteria_tree = None
+        self.model.time += 1
+        return self.partial()
+
+    def cells(self):
+        return columns(self.model.bacteria)
+
+    def antibiotics(self):
+        return columns(self.model.antibiotics)
+
+
+def serve(conn, *args):  # worker process: build a Domain, then run the commands sent by Domains
+    try:
+        domain = Domain(*args)
+        conn.send(('ok', domain.partial()))
+    except Exception:
+        conn.send(('error', traceback.format_exc()))
+        return
+    while True:
+        command, command_args = conn.recv()
+        if command == 'stop':
+            break
+        try:
+            conn.send(('ok', getattr(domain, command)(*command_args)))
+        except Exception:
+            conn.send(('error', traceback.format_exc()))
+
+
+class Domains:
+    # the dish split over n_domains worker processes, stepped like an SGEModel:
+    #   dish = Domains(4, params, seed); dish.initialize(); dish.update() ...; dish.close()
+    def __init__(self, n_domains, params=None, seed=None, history_length=10000):
+        self.n_domains = n_domains
+        self.model = sge_model.SGEModel(**(params or {}))  # parameters, and the dosing of the coordinator
+        self.params = self.model.get_parameters()
+        self.seed = headless.seed_sequence(seed)
+        self.history_length = history_length
+        self.workers = []
+
+    def call(self, command, args):  # run a command in all workers at once, args: one tuple per worker
+        for conn, worker_args in zip(self.conns, args):
+            conn.send((command, worker_args))
+        return [self.receive(conn) for conn in self.conns]
+
+    def receive(self, conn):
+        status, result = conn.recv()
+        if status == 'error':
+            self.close()
+            raise RuntimeError('domain worker failed:\n' + result)
+        return result
+
+    def initialize(self):
+        self.close()
+        self.model.history_length = self.history_length
+        if self.model.antibiotic_field:
+            raise ValueError('the antibiotic concentration field is not supported with domains')
+        width = self.model.x_size / self.n_domains
+        if width < 2 * halo_width(self.model):
+            raise ValueError('strips of width %g are too narrow for %d domains, the halo needs %g'
+                             % (width, self.n_domains, halo_width(self.model)))
+
+        # the coordinator draws the initial cells and every dose, each strip has a stream of its own
+        streams = self.seed.spawn(self.n_domains + 1)
+        self.model.seed(streams[0])
+        x = self.model.rng.uniform(0, self.model.x_size, self.model.n_pop)
+        y = self.model.rng.uniform(0, self.model.y_size, self.model.n_pop)
+        owner = np.minimum((x // width).astype(np.int64), self.n_domains - 1)
+        ids = np.arange(self.model.n_pop)
+
+        context = multiprocessing.get_context()
+        self.conns = []
+        for k in range(self.n_domains):
+            parent, child = context.Pipe()
+            mine = owner == k
+            cells = {'x': x[mine], 'y': y[mine], 'id': ids[mine]}
+            next_id = self.model.n_pop + (k << 40)  # disjoint identifier ranges per strip
+            worker = context.Process(target=serve, args=(child, k, self.n_domains, self.params, streams[k + 1],
+                                                         cells, next_id), daemon=True)
+            worker.start()
+            self.workers.append(worker)
+            self.conns.append(parent)
+        partials = [self.receive(conn) for conn in self.conns]
+
+        self.model.antibiotics = sge_model.Antibiotics()
+        self.model.field = None  # dosing only, the field mode is rejected above
+        self.stats = self.model.new_stats()
+        self.stats.record_partials(0, partials)
+        self.time = 1
+        self.cell_count = sum(count for count, _ in partials)
+
+    def dose(self):  # new antibiotic molecules of this step, drawn as SGEModel.update() would
+        if self.time % self.model.intro_period != 0 or self.model.add_antibiotic not in (1, 2):
+            return None
+        self.model.antibiotics = sge_model.Antibiotics()
+        if self.model.add_antibiotic == 1:
+            self.model.add_antibiotics_random()
+        else:
+            self.model.add_antibiotics_droplet()
+        return {'x': self.model.antibiotics.x.copy(), 'y': self.model.antibiotics.y.copy()}
+
+    def exchange(self, halos):  # (left, right) halo of every strip -> (from left, from right) args of every strip
+        empty = self.empty_like(halos[0][0])
+        return [(halos[k - 1][1] if k > 0 else empty, halos[k + 1][0] if k < self.n_domains - 1 else empty)
+                for k in range(self.n_domains)]
+
+    def empty_like(self, halo):
+        if isinstance(halo, dict):
+            return {name: values[:0] for name, values in halo.items()}
+        return halo[:0]
+
+    def update(self):
+        dose = self.dose()
+        halos = self.call('begin', [(dose,)] * self.n_domains)
+        halos = self.call('move', self.exchange(halos))
+        offspring = self.call('divide', self.exchange(halos))
+        offspring = [offspring[k - 1] if k > 0 else np.empty((0, 2)) for k in range(self.n_domains)]
+        results = self.call('survive', [(o,) for o in offspring])
+
+        used = np.logical_or.reduce([used for used, _ in results])
+        width = self.model.x_size / self.n_domains
+        immigrants = [[] for k in range(self.n_domains)]
+        for _, emigrants in results:
+            if emigrants is None:
+                continue
+            owner = np.minimum((emigrants['x'] // width).astype(np.int64), self.n_domains - 1)
+            for k in np.unique(owner):
+                immigrants[k].append({name: values[owner == k] for name, values in emigrants.items()})
+        partials = self.call('end', [(used, concat(cells)) for cells in immigrants])
+
+        self.stats.record_partials(self.time, partials)
+        self.cell_count = sum(count for count, _ in partials)
+        self.time += 1
+
+    def cells(self):  # the whole population, strip by strip
+        return concat(self.call('cells', [()] * self.n_domains))
+
+    def antibiotics(self):  # identical in every strip
+        return self.call('antibiotics', [()] * self.n_domains)[0]
+
+    def close(self):
+        for conn, worker in zip(getattr(self, 'conns', []), self.workers):
+            if worker.is_alive():
+                try:
+                    conn.send(('stop', ()))
+                except OSError:
+                    pass
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+        self.workers = []
+        self.conns = []
+
+
+def run(steps, n_domains, seed=None, params=None, stop_when_extinct=True):
+    # like headless.run(), results can be saved with headless.save()
+    dish = Domains(n_domains, params, seed, history_length=steps + 1)
+    try:
+        dish.initialize()
+        while dish.time <= steps:
+            if stop_when_extinct and dish.cell_count == 0:
+                break
+            dish.update()
+        results = {name: values.copy() for name, values in dish.stats.series().items()}
+        results['steps'] = dish.time - 1
+        results['params'] = dish.params
+        results['seed'] = dish.seed
+        for name, values in dish.cells().items():
+            results['bacteria_' + name] = values
+        for name, values in dish.antibiotics().items():
+            results['antibiotics_' + name] = values
+    finally:
+        dish.close()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the SGE-ABM model with the dish split over processes.')
+    parser.add_argument('--domains', type=int, default=multiprocessing.cpu_count(),
+                        help='number of strips and worker processes (default: number of CPUs)')
+    parser.add_argument('--steps', type=int, default=200, help='number of update() steps')
+    parser.add_argument('--seed', type=int, default=None, help='random seed (default: fresh entropy, saved with the results)')
+    parser.add_argument('--set', dest='params', action='append', default=[], metavar='NAME=VALUE',
+                        help='override a model parameter, may be repeated (one of: %s)' % ', '.join(sge_model.PARAMETERS))
+    parser.add_argument('--keep-going', action='store_true', help='keep stepping after the population died out')
+    parser.add_argument('-o', '--output', default='sge-abm-run.npz', help='output .npz file')
+    args = parser.parse_args(argv)
+
+    try:
+        params = headless.parse_assignments(args.params)
+        sge_model.SGEModel(**params)  # check the names and values
+    except ValueError as e:
+        parser.error(str(e))
+
+    results = run(args.steps, args.domains, args.seed, params, stop_when_extinct=not args.keep_going)
+    headless.save(results, args.output)
+    print('%d steps, %d cells left, written to %s' % (results['steps'], results['cell_counts'][-1], args.output))
+
+
+if __name__ == '__main__':
+    main()
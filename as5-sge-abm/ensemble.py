@@ -0,0 +1,123 @@
+## Ensembles of SGE-ABM replicates stepped in lockstep
+##
+## An Ensemble holds K independent replicates of one parameter set in a single
+## agent store. Every cell carries its replicate number, and the replicates'
+## dishes are laid out side by side along x, each shifted by its own offset and
+## separated from the next by a gap wider than any interaction range (min_dist,
+## kill_radius). One KD-tree query, one binomial draw or one compaction then
+## serves all replicates, yet no cell ever sees a cell or molecule of another
+## replicate, so a single update() advances the whole ensemble for the
+## interpreter overhead of one model step.
+##
+## Replicates are statistically independent but share one random stream, so
+## replicate k does not reproduce a single run with some seed; the ensemble as
+## a whole is reproducible from its seed. The antibiotic concentration field
+## is not supported.
+##
+##   python ensemble.py --replicates 200 --steps 200 --seed 1 --set add_antibiotic=1 -o ensemble.npz
+##
+## writes the same .npz file as headless.py, with a trailing replicate axis on
+## every series (cell_counts[t, k]) and a bacteria_replicate column.
+
+import argparse
+
+import numpy as np
+
+import headless
+from population_stats import Histogram, ReplicateStats
+import sge_model
+
+
+class ReplicateBacteria(sge_model.Bacteria):
+    columns = dict(sge_model.Bacteria.columns, replicate=(np.int64, 0))  # replicate the cell belongs to
+
+
+class Ensemble(sge_model.SGEModel):
+    sort_period = 5  # all dishes together are a large dish, where sorting by position pays off
+
+    def __init__(self, replicates, seed=None, **params):
+        super().__init__(seed, **params)
+        self.replicates = replicates
+
+    def initialize(self):
+        if self.antibiotic_field:
+            raise ValueError('the antibiotic concentration field is not supported in an ensemble')
+        # the gap between dishes is fixed here, from the interaction ranges at initialize()
+        reach = max(self.min_dist, self.effective_kill_radius())
+        self.offsets = np.arange(self.replicates) * (self.x_size + 2 * reach)  # left edge of every dish
+        super().initialize()
+
+    def new_population(self):
+        replicate = np.repeat(np.arange(self.replicates), self.n_pop)
+        bacteria = ReplicateBacteria(capacity=max(64, 2 * len(replicate)))
+        bacteria.append(x=self.offsets[replicate] + self.rng.uniform(0, self.x_size, len(replicate)),
+                        y=self.rng.uniform(0, self.y_size, len(replicate)), id=bacteria.new_ids(len(replicate)),
+                        replicate=replicate)
+        return bacteria
+
+    def new_stats(self):
+        return ReplicateStats(self.replicates, {
+            'prot': ('prot_count', Histogram(0, 1000, 100)),
+            'mrna': ('mrna_count', Histogram(0, 500, 100)),
+            'age': ('age', Histogram(0, self.lifetime + 2, self.lifetime + 2)),
+        }, history=self.history_length)
+
+    def clip_to_dish(self, x, y, rows):
+        low = self.offsets[self.bacteria.replicate[rows]]
+        return np.clip(x, low, low + self.x_size), np.clip(y, 0, self.y_size)
+
+    def inherited(self, parents):
+        return {'replicate': self.bacteria.replicate[parents]}
+
+    def add_antibiotics_random(self):  # n_molec molecules in every dish
+        self.antibiotics_tree = None
+        low = np.repeat(self.offsets, self.n_molec)
+        self.antibiotics.append(x=low + self.rng.uniform(0, self.x_size, len(low)),
+                                y=self.rng.uniform(0, self.y_size, len(low)))
+
+    def add_antibiotics_droplet(self):  # one droplet in every dish
+        self.antibiotics_tree = None
+        self.antibiotics.append(x=self.offsets + self.rng.uniform(0, self.x_size, self.replicates),
+                                y=self.rng.uniform(0, self.y_size, self.replicates))
+
+    def replicate_counts(self):  # number of cells in every replicate
+        return np.bincount(self.bacteria.replicate, minlength=self.replicates)
+
+
+def run(steps, replicates, seed=None, params=None, stop_when_extinct=True):
+    # like headless.run(), stopping once every replicate died out; results can be saved with headless.save()
+    model = Ensemble(replicates, **(params or {}))
+    used_params = model.get_parameters()
+    model.history_length = steps + 1
+    seed = headless.seed_sequence(seed)
+    model.seed(seed)
+    model.initialize()
+    return headless.run_steps(model, steps, seed, used_params, stop_when_extinct, None, 0)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run replicates of the SGE-ABM model in lockstep.')
+    parser.add_argument('--replicates', type=int, default=100, help='number of replicates')
+    parser.add_argument('--steps', type=int, default=200, help='number of update() steps')
+    parser.add_argument('--seed', type=int, default=None, help='random seed (default: fresh entropy, saved with the results)')
+    parser.add_argument('--set', dest='params', action='append', default=[], metavar='NAME=VALUE',
+                        help='override a model parameter, may be repeated (one of: %s)' % ', '.join(sge_model.PARAMETERS))
+    parser.add_argument('--keep-going', action='store_true', help='keep stepping after every replicate died out')
+    parser.add_argument('-o', '--output', default='sge-abm-ensemble.npz', help='output .npz file')
+    args = parser.parse_args(argv)
+
+    try:
+        params = headless.parse_assignments(args.params)
+        if sge_model.SGEModel(**params).antibiotic_field:
+            raise ValueError('the antibiotic concentration field is not supported in an ensemble')
+    except ValueError as e:
+        parser.error(str(e))
+
+    results = run(args.steps, args.replicates, args.seed, params, stop_when_extinct=not args.keep_going)
+    headless.save(results, args.output)
+    alive = np.count_nonzero(results['cell_counts'][-1])
+    print('%d steps, %d of %d replicates alive, written to %s' % (results['steps'], alive, args.replicates, args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+## Exact continuous-time gene expression for the SGE-ABM model
+##
+## The per-step probabilities of biosynth() describe a two-state (telegraph)
+## promoter driving transcription, with mRNA removed by degradation or by
+## translation into protein, and proteins degrading. Read as a continuous-time
+## Markov process with one unit of time per ABM tick, the rates are
+##
+##   promoter on / off      k_on + k_off = -log(1 - prot_activ_prob - prot_deactiv_prob),
+##                          k_on = (k_on + k_off) prot_activ_prob / (prot_activ_prob + prot_deactiv_prob),
+##                          so that the chance to be on or off after one tick, and the
+##                          fraction of active promoters, are those of the per-step switches
+##   transcription          mrna_synth_rate while the promoter is on
+##   mRNA removal           r = -log(1 - mrna_degr_prob - prot_synth_prob),
+##                          a fraction prot_synth_prob / (mrna_degr_prob + prot_synth_prob)
+##                          of the removals being translations
+##   protein degradation    d = -log(1 - prot_degr_prob)
+##
+## Only the promoter switches are simulated event by event (next-reaction
+## style, one exponential draw per switch). Between two switches every
+## reaction is first order, so the fate of each molecule is independent and
+## the end-of-interval counts can be drawn exactly from binomial and Poisson
+## distributions. A tick therefore costs a handful of draws per cell, for all
+## cells at once, instead of one event per molecule.
+
+import numpy as np
+
+
+def rates(prot_activ_prob, prot_deactiv_prob, mrna_synth_rate, mrna_degr_prob, prot_synth_prob, prot_degr_prob):
+    def hazard(p):  # constant rate with probability p of at least one event per unit time
+        return -np.log1p(-min(p, 1 - 1e-12))
+
+    # the promoter may switch several times per tick, so its rates are fixed by the
+    # one-tick transition probabilities, off -> on = k_on / (k_on + k_off) (1 - exp(-k_on - k_off));
+    # a sum of the probabilities of 1 or more cannot be matched (the per-step chain then alternates),
+    # hazard() caps it, keeping the fraction of active promoters
+    switch = prot_activ_prob + prot_deactiv_prob
+    k = hazard(switch)
+    removal = mrna_degr_prob + prot_synth_prob
+    r = hazard(removal)
+    return {
+        'on': k * prot_activ_prob / switch if switch > 0 else 0.0,
+        'off': k * prot_deactiv_prob / switch if switch > 0 else 0.0,
+        'synth': float(mrna_synth_rate),
+        'removal': r,
+        'trans': r * prot_synth_prob / removal if removal > 0 else 0.0,
+        'degr': hazard(prot_degr_prob),
+    }
+
+
+def phi(k, t):  # integral of exp(-k s) for s in [0, t], also for k <= 0
+    if k == 0:
+        return t
+    return -np.expm1(-k * t) / k
+
+
+def phi2(k, t):  # integral of s exp(-k s) for s in [0, t]
+    if k == 0:
+        return t**2 / 2
+    return (-np.expm1(-k * t) - k * t * np.exp(-k * t)) / k**2
+
+
+def interval_outcomes(active, t, rate):
+    # fates over an interval of length t (array) with the promoter fixed:
+    # - p_mrna, p_prot: probability that a molecule present at the start is
+    #   still mRNA, or was translated into a protein still there at the end
+    # - mean_mrna, mean_prot: expected number of molecules transcribed during
+    #   the interval that end as mRNA or as a surviving protein; transcription
+    #   is a Poisson process, so these counts are Poisson distributed
+    r, k, d = rate['removal'], rate['trans'], rate['degr']
+    p_mrna = np.exp(-r * t)
+    p_prot = k * np.exp(-d * t) * phi(r - d, t)
+    if r == d:
+        prot_per_synth = k * phi2(d, t)
+    else:
+        prot_per_synth = k * (phi(d, t) - phi(r, t)) / (r - d)
+    synth = np.where(active, rate['synth'], 0.0)
+    return p_mrna, p_prot, synth * phi(r, t), synth * prot_per_synth
+
+
+def advance(prot_activ, mrna_counts, prot_counts, rate, rng, duration=1.0):
+    # exact simulation of every cell over one tick of the given duration
+    prot_activ = prot_activ.copy()
+    mrna_counts = mrna_counts.copy()
+    prot_counts = prot_counts.copy()
+    remaining = np.full(len(prot_activ), float(duration))
+    cells = np.arange(len(prot_activ))
+
+    while len(cells) > 0:
+        active = prot_activ[cells]
+        switch_rate = np.where(active, rate['off'], rate['on'])
+        with np.errstate(divide='ignore'):
+            wait = rng.exponential(1.0, len(cells)) / switch_rate  # inf if the promoter never switches
+        t = np.minimum(wait, remaining[cells])
+
+        p_mrna, p_prot, mean_mrna, mean_prot = interval_outcomes(active, t, rate)
+        mrna = mrna_counts[cells]
+        kept_mrna = rng.binomial(mrna, p_mrna)
+        # a molecule that did not stay mRNA became a surviving protein with p_prot / (1 - p_mrna)
+        p_prot_given_gone = np.divide(p_prot, 1 - p_mrna, out=np.zeros_like(p_prot), where=p_mrna < 1)
+        prot_from_mrna = rng.binomial(mrna - kept_mrna, np.clip(p_prot_given_gone, 0, 1))
+        kept_prot = rng.binomial(prot_counts[cells], np.exp(-rate['degr'] * t))
+
+        mrna_counts[cells] = kept_mrna + rng.poisson(mean_mrna)
+        prot_counts[cells] = kept_prot + prot_from_mrna + rng.poisson(mean_prot)
+
+        switched = wait < remaining[cells]
+        prot_activ[cells[switched]] = ~active[switched]
+        remaining[cells] -= t
+        cells = cells[switched]
+
+    return prot_activ, mrna_counts, prot_counts
@@ -0,0 +1,146 @@
+## Headless batch runner for the SGE-ABM model
+##
+## Runs initialize()/update() of an SGEModel without Tk or pyplot and writes the
+## recorded time series and the final population to a compressed .npz file:
+##
+##   python headless.py --steps 200 --seed 1 --set add_antibiotic=1 --set n_molec=100 -o run.npz
+##
+## Only NumPy is imported (SciPy is loaded by the model once antibiotics are
+## added), so thousands of short runs are not dominated by start-up time.
+
+import argparse
+import json
+
+import numpy as np
+
+import checkpoint
+import profiling
+import sge_model
+import trajectory
+
+
+def seed_sequence(seed):  # int, SeedSequence or None (fresh entropy, recorded so the run can be repeated)
+    if isinstance(seed, np.random.SeedSequence):
+        return seed
+    return np.random.SeedSequence(seed)
+
+
+def run(steps, seed=None, params=None, stop_when_extinct=True, checkpoint_path=None, checkpoint_every=0,
+        resume=False, trajectory_path=None, profiler=None):
+    # a population that died out never recovers, so by default the run stops there;
+    # with checkpoint_path the state is saved every checkpoint_every steps, and
+    # resume=True continues from that file (seed and params are then taken from it);
+    # trajectory_path records every cell at every step (see trajectory.py);
+    # profiler is a profiling.PhaseProfiler to fill during the run
+    if resume:
+        model, extra = checkpoint.load(checkpoint_path, history_length=steps + 1)
+        used_params = extra['params']
+        seed = np.random.SeedSequence(int(extra['seed_entropy']), spawn_key=tuple(extra['seed_spawn_key']))
+    else:
+        model = sge_model.SGEModel(**(params or {}))
+        used_params = model.get_parameters()
+        model.history_length = steps + 1  # keep the whole run
+        seed = seed_sequence(seed)
+        model.seed(seed)
+    model.profiler = profiler
+    if trajectory_path:
+        model.recorder = trajectory.TrajectoryWriter(trajectory_path, append=resume)
+    try:
+        if not resume:
+            model.initialize()
+        return run_steps(model, steps, seed, used_params, stop_when_extinct, checkpoint_path, checkpoint_every)
+    finally:
+        if model.recorder:
+            model.recorder.close()
+
+
+def run_steps(model, steps, seed, used_params, stop_when_extinct, checkpoint_path, checkpoint_every):
+    extra = {'params': used_params, 'seed_entropy': str(seed.entropy), 'seed_spawn_key': list(seed.spawn_key)}
+    while model.time <= steps:
+        if stop_when_extinct and len(model.bacteria) == 0:
+            break
+        model.update()
+        if checkpoint_every and (model.time - 1) % checkpoint_every == 0:
+            if model.recorder:
+                model.recorder.flush()  # a resumed run records from the next step on, this one must be on disk
+            checkpoint.save(model, checkpoint_path, extra)
+
+    results = {name: values.copy() for name, values in model.stats.series().items()}
+    results['steps'] = model.time - 1
+    results['params'] = used_params
+    results['seed'] = seed
+    for name in model.bacteria.columns:
+        results['bacteria_' + name] = model.bacteria.data[name][:len(model.bacteria)].copy()
+    for name in model.antibiotics.columns:
+        results['antibiotics_' + name] = model.antibiotics.data[name][:len(model.antibiotics)].copy()
+    if model.field is not None:
+        results['antibiotic_field'] = model.field.values.copy()
+    return results
+
+
+def save(results, path):
+    arrays = dict(results)
+    arrays['params'] = np.array(json.dumps(arrays['params']))
+    arrays['seed_entropy'] = np.array(str(results['seed'].entropy))
+    arrays['seed_spawn_key'] = np.array(results['seed'].spawn_key, dtype=np.int64)
+    del arrays['seed']
+    np.savez_compressed(path, **arrays)
+
+
+def load(path):
+    with np.load(path) as f:
+        results = {name: f[name] for name in f.files}
+    results['params'] = json.loads(str(results['params']))
+    results['steps'] = int(results['steps'])
+    results['seed'] = np.random.SeedSequence(int(results.pop('seed_entropy')),
+                                             spawn_key=tuple(int(k) for k in results.pop('seed_spawn_key')))
+    return results
+
+
+def parse_assignments(assignments):  # ['name=value', ...] -> {name: value}
+    params = {}
+    for assignment in assignments:
+        name, sep, val = assignment.partition('=')
+        if not sep:
+            raise ValueError('expected name=value, got ' + assignment)
+        params[name.strip()] = val.strip()
+    return params
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the SGE-ABM model without a GUI.')
+    parser.add_argument('--steps', type=int, default=200, help='number of update() steps')
+    parser.add_argument('--seed', type=int, default=None, help='random seed (default: fresh entropy, saved with the results)')
+    parser.add_argument('--set', dest='params', action='append', default=[], metavar='NAME=VALUE',
+                        help='override a model parameter, may be repeated (one of: %s)' % ', '.join(sge_model.PARAMETERS))
+    parser.add_argument('--keep-going', action='store_true', help='keep stepping after the population died out')
+    parser.add_argument('--checkpoint', metavar='FILE', help='checkpoint file to write (and to resume from)')
+    parser.add_argument('--checkpoint-every', type=int, default=100, metavar='K',
+                        help='save a checkpoint every K steps (default: 100)')
+    parser.add_argument('--resume', action='store_true', help='continue the run saved in --checkpoint')
+    parser.add_argument('--trajectory', metavar='FILE',
+                        help='record every cell at every step to this file (appended to with --resume)')
+    parser.add_argument('--profile', metavar='CSV', help='write per-step phase timings to this CSV file')
+    parser.add_argument('-o', '--output', default='sge-abm-run.npz', help='output .npz file')
+    args = parser.parse_args(argv)
+    if args.resume and not args.checkpoint:
+        parser.error('--resume needs --checkpoint')
+
+    try:
+        params = parse_assignments(args.params)
+        sge_model.SGEModel(**params)  # check the names and values
+    except ValueError as e:
+        parser.error(str(e))
+
+    profiler = profiling.PhaseProfiler(history=args.steps) if args.profile else None
+    results = run(args.steps, args.seed, params, stop_when_extinct=not args.keep_going,
+                  checkpoint_path=args.checkpoint, checkpoint_every=args.checkpoint_every if args.checkpoint else 0,
+                  resume=args.resume, trajectory_path=args.trajectory, profiler=profiler)
+    save(results, args.output)
+    if args.profile:
+        profiler.to_csv(args.profile)
+    print('%d steps, %d cells left, written to %s' % (results['steps'], results['cell_counts'][-1], args.output))
+
+
+if __name__ == '__main__':
+    main()
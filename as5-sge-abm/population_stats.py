@@ -0,0 +1,173 @@
+## Streaming population statistics for the SGE-ABM model
+##
+## Every step the model hands its current population to PopulationStats.record(),
+## which reduces each tracked column to count, mean, standard deviation and a
+## fixed-bin histogram in a single sweep over the arrays. The scalar results go
+## into preallocated ring buffers, so memory is bounded by the history length and
+## reading the latest values or the whole series never rebuilds anything; of the
+## histograms only the latest is kept, they would take most of the memory of a
+## long history and nothing reads the older ones.
+
+import numpy as np
+
+
+class RingBuffer:
+    # fixed-capacity FIFO over a preallocated array; once full, the oldest rows are overwritten
+    def __init__(self, capacity, shape=(), dtype=np.float64):
+        self.data = np.zeros((capacity,) + tuple(shape), dtype=dtype)
+        self.start = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def capacity(self):
+        return len(self.data)
+
+    def append(self, value):
+        end = (self.start + self.size) % self.capacity()
+        self.data[end] = value
+        if self.size < self.capacity():
+            self.size += 1
+        else:
+            self.start = (self.start + 1) % self.capacity()
+
+    def extend(self, values):  # append many rows at once
+        values = np.asarray(values)[-self.capacity():]
+        end = (self.start + self.size) % self.capacity()
+        self.data[(end + np.arange(len(values))) % self.capacity()] = values
+        overflow = max(self.size + len(values) - self.capacity(), 0)
+        self.size = min(self.size + len(values), self.capacity())
+        self.start = (self.start + overflow) % self.capacity()
+
+    def last(self):
+        return self.data[(self.start + self.size - 1) % self.capacity()]
+
+    def values(self):  # rows in chronological order, a view unless the buffer has wrapped around
+        if self.start + self.size <= self.capacity():
+            return self.data[self.start:self.start + self.size]
+        return np.concatenate((self.data[self.start:], self.data[:self.start + self.size - self.capacity()]))
+
+
+class Histogram:
+    # nbins equal-width bins over [low, high); values outside are counted in the first or last bin
+    def __init__(self, low, high, nbins):
+        self.low = low
+        self.high = high
+        self.nbins = nbins
+        self.edges = np.linspace(low, high, nbins + 1)
+
+    def bins(self, values):  # bin index of every value
+        bins = ((values - self.low) * (self.nbins / (self.high - self.low))).astype(np.int64)
+        np.clip(bins, 0, self.nbins - 1, out=bins)
+        return bins
+
+    def counts(self, values):
+        return np.bincount(self.bins(values), minlength=self.nbins)
+
+
+class RecordedStats:
+    # ring buffers of the recorded history, the latest histograms and the ways to read them;
+    # every recorded value has the given shape, () for one population, (replicates,) for replicates
+    def __init__(self, quantities, history=10000, shape=()):
+        # quantities: name -> (column of the agent store, Histogram)
+        self.quantities = quantities
+        self.time = RingBuffer(history, dtype=np.int64)
+        self.cell_counts = RingBuffer(history, shape=shape, dtype=np.int64)
+        self.means = {name: RingBuffer(history, shape=shape) for name in quantities}
+        self.stds = {name: RingBuffer(history, shape=shape) for name in quantities}
+        self.hists = {name: np.zeros(tuple(shape) + (hist.nbins,), dtype=np.int64)  # latest step only
+                      for name, (_, hist) in quantities.items()}
+
+    def buffers(self):  # name -> ring buffer, for saving and restoring the recorded history
+        buffers = {'time': self.time, 'cell_counts': self.cell_counts}
+        for name in self.quantities:
+            buffers['means_' + name] = self.means[name]
+            buffers['stds_' + name] = self.stds[name]
+        return buffers
+
+    def histogram(self, name):  # bin edges and counts of the latest step
+        return self.quantities[name][1].edges, self.hists[name]
+
+    def series(self):  # recorded time series as arrays: time, cell_counts, <name>_means, <name>_stds
+        series = {'time': self.time.values(), 'cell_counts': self.cell_counts.values()}
+        for name in self.quantities:
+            series[name + '_means'] = self.means[name].values()
+            series[name + '_stds'] = self.stds[name].values()
+        return series
+
+    def snapshot(self):  # copy of the series and latest histograms that later records leave unchanged
+        histograms = {}
+        for name in self.quantities:
+            edges, counts = self.histogram(name)
+            histograms[name] = (edges, counts.copy())
+        return StatsSnapshot({name: values.copy() for name, values in self.series().items()}, histograms)
+
+
+class PopulationStats(RecordedStats):
+    def record(self, time, agents):
+        self.record_partials(time, [self.partial(agents)])
+        
+    def partial(self, agents):
+        # count, sums, sums of squares and histograms of one part of the population,
+        # partials of disjoint parts add up to those of the whole (see record_partials)
+        sums = {}
+        for name, (column, hist) in self.quantities.items():
+            values = getattr(agents, column)
+            sums[name] = (values.sum(), np.dot(values, values), hist.counts(values))  # exact for count columns
+        return len(agents), sums
+        
+    def record_partials(self, time, partials):
+        n = sum(count for count, _ in partials)
+        self.time.append(time)
+        self.cell_counts.append(n)
+        for name in self.quantities:
+            total = sum(sums[name][0] for _, sums in partials)
+            squares = sum(sums[name][1] for _, sums in partials)
+            if n > 0:
+                mean = total / n
+                var = max(squares / n - mean**2, 0)
+            else:
+                mean = var = np.nan
+            self.means[name].append(mean)
+            self.stds[name].append(np.sqrt(var))
+            self.hists[name] = sum((sums[name][2] for _, sums in partials), np.zeros_like(self.hists[name]))
+
+
+class StatsSnapshot:
+    # series() and histogram() of a PopulationStats at one moment
+    def __init__(self, series, histograms):
+        self.data = series
+        self.histograms = histograms
+
+    def histogram(self, name):
+        return self.histograms[name]
+
+    def series(self):
+        return self.data
+
+
+class ReplicateStats(RecordedStats):
+    # statistics of independent replicates kept in one agent store with a
+    # 'replicate' column (see ensemble.py); every recorded value gets a replicate
+    # axis, so series() returns (steps x replicates) arrays and histogram() a
+    # (replicates x bins) array, all computed with one bincount per reduction;
+    # there are no partials, an ensemble is not split over domains
+    def __init__(self, replicates, quantities, history=10000):
+        super().__init__(quantities, history, shape=(replicates,))
+        self.replicates = replicates
+
+    def record(self, time, agents):
+        replicate = agents.replicate
+        n = np.bincount(replicate, minlength=self.replicates)
+        self.time.append(time)
+        self.cell_counts.append(n)
+        for name, (column, hist) in self.quantities.items():
+            values = getattr(agents, column).astype(np.float64)  # exact for count columns below 2**53
+            with np.errstate(invalid='ignore', divide='ignore'):  # replicates without cells get nan
+                mean = np.bincount(replicate, values, self.replicates) / n
+                var = np.maximum(np.bincount(replicate, values * values, self.replicates) / n - mean**2, 0)
+            self.means[name].append(mean)
+            self.stds[name].append(np.sqrt(var))
+            counts = np.bincount(replicate * hist.nbins + hist.bins(values), minlength=self.replicates * hist.nbins)
+            self.hists[name] = counts.reshape(self.replicates, hist.nbins)
@@ -0,0 +1,71 @@
+## Opt-in per-phase profiling of the SGE-ABM update step
+##
+## SGEModel.update() calls the profiler between its phases only when the
+## model's profiler is set, so the cost when profiling is off is one
+## attribute test per phase. Every step becomes one row of the table:
+## wall time and call count per phase, plus the population size.
+##
+##   model = sge_model.SGEModel()
+##   model.profiler = profiling.PhaseProfiler()
+##   ... run the model ...
+##   model.profiler.to_csv('phases.csv')
+
+import collections
+import csv
+import time
+
+
+class PhaseProfiler:
+    def __init__(self, history=10000):
+        self.rows = collections.deque(maxlen=history)  # one dict per step, oldest dropped first
+        self.phases = []  # phase names in the order they were first seen
+        self.row = None
+        self.last = None
+
+    def begin_step(self, step, n_cells):
+        self.row = {'step': step, 'cells': n_cells}
+        self.last = time.perf_counter()
+
+    def mark(self, phase):  # the time since the previous mark (or begin_step) was spent in phase
+        now = time.perf_counter()
+        self.add(phase, now - self.last)
+        self.last = now
+
+    def add(self, phase, seconds, calls=1):  # time spent outside the mark sequence, e.g. in an inner function
+        if phase not in self.phases:
+            self.phases.append(phase)
+        self.row[phase + '_s'] = self.row.get(phase + '_s', 0.0) + seconds
+        self.row[phase + '_calls'] = self.row.get(phase + '_calls', 0) + calls
+
+    def end_step(self):
+        self.rows.append(self.row)
+        self.row = None
+
+    def fields(self):
+        fields = ['step', 'cells']
+        for phase in self.phases:
+            fields += [phase + '_s', phase + '_calls']
+        return fields
+
+    def table(self):  # list of per-step dicts, missing phases filled with zeros
+        return [{field: row.get(field, 0) for field in self.fields()} for row in self.rows]
+
+    def to_csv(self, path):
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=self.fields())
+            writer.writeheader()
+            writer.writerows(self.table())
+
+    def mean_seconds(self, last=None):  # phase -> mean seconds per step over the recorded steps, or the last ones
+        rows = list(self.rows)[-last:] if last else self.rows
+        n = max(len(rows), 1)
+        return {phase: sum(row.get(phase + '_s', 0.0) for row in rows) / n for phase in self.phases}
+
+    def summary(self, top=3):  # short text of the latest step for a status line
+        if not self.rows:
+            return ''
+        row = self.rows[-1]
+        total = sum(row.get(phase + '_s', 0.0) for phase in self.phases if phase != 'check_free_space')
+        slowest = sorted(self.phases, key=lambda phase: -row.get(phase + '_s', 0.0))[:top]
+        return 'step %d, %d cells: %.1f ms\n' % (row['step'], row['cells'], 1000 * total) + ', '.join(
+            '%s %.1f ms' % (phase, 1000 * row.get(phase + '_s', 0.0)) for phase in slowest)
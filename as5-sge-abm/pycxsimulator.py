@@ -31,11 +31,64 @@
 ##
 ## import matplotlib
 ## matplotlib.use('TkAgg')
+##
+## With GUI(background=True) the model steps in a worker thread while the Tk
+## loop redraws the most recent state up to 25 times per second. observe() then
+## must not read a model that update() is changing; pass a function returning a
+## copy of the state as start(func=[...], snapshot=...), and observe(snapshot)
+## draws that copy. Without one, observe() runs while the worker waits.
+##
+## Headless runs, e.g. on a server: HeadlessGUI takes the same arguments and
+## start(func=[...]) as GUI, but opens no window. It steps the model as fast as
+## it can, saves observe() to an image every `every` steps and returns after
+## `steps` steps. An unchanged model script or notebook runs headless with
+##
+## python pycxsimulator.py --steps 1000 --every 100 --output frames model.py
+##
+## which selects the Agg backend, ignores the model's matplotlib.use('TkAgg'),
+## makes pycxsimulator.GUI a HeadlessGUI and runs model.py (or the code cells
+## of model.ipynb). --set NAME=VALUE calls a parameter setter before initialize.
+## A notebook with several models runs one of them with --cells, e.g.
+## --cells 9 runs the panic CA of wk3.ipynb. Tk is not needed for headless runs.
+##
+## With a target frame rate (GUI(targetFPS=...) or the Settings tab) the step
+## size is chosen automatically: the time of a model step and of a redraw are
+## measured as the model runs, and between two redraws the model is stepped for
+## what is left of the frame period once the redraw is paid for. A model that
+## slows down, e.g. as its population grows, is redrawn after fewer steps.
+##
+## The Telemetry tab shows, once per second, the steps per second, the mean time
+## of a model step and of a redraw and the memory of the process (RSS). A model
+## can add its own figures with start(func=[...], telemetry=...): a function
+## returning a dict of name -> number, e.g. agent counts or phase timings.
 
-import pylab as PL
-from tkinter import ttk
-from tkinter import *
-from tkinter.ttk import Notebook
+import argparse
+import json
+import os
+import queue
+import runpy
+import sys
+import threading
+import time
+import traceback
+
+try:
+    from tkinter import ttk
+    from tkinter import *
+    from tkinter.ttk import Notebook
+except ImportError as e:  # Python built without Tk, only HeadlessGUI works
+    tkinterError = e
+else:
+    tkinterError = None
+
+PL = None  # pylab, imported by the first GUI so that main() can choose the backend before pyplot loads
+
+
+def importPylab():
+    global PL
+    if PL is None:
+        import pylab
+        PL = pylab
 
 
 class GUI:
@@ -47,15 +100,49 @@ class GUI:
     modelFigure = None
     stepSize = 1
     currentStep = 0
+    frameInterval = 40            # redraw period in milliseconds when the model runs in the background
+    telemetryInterval = 1000      # update period of the Telemetry tab in milliseconds
+    targetFPS = 0                 # redraws per second the step size is tuned for, 0 redraws every stepSize steps
     
     # Constructor
-    def __init__(self, title='PyCX Simulator', interval=0, stepSize=1, parameterSetters=[]):
+    def __init__(self, title='PyCX Simulator', interval=0, stepSize=1, parameterSetters=[], background=False,
+                 targetFPS=0):
+        if tkinterError is not None:
+            raise ImportError('the PyCX GUI needs tkinter, HeadlessGUI runs without it') from tkinterError
+        importPylab()
         self.titleText = title
         self.timeInterval = interval
         self.stepSize = stepSize
+        self.targetFPS = targetFPS
+        self.stepTime = None        # smoothed seconds per model step
+        self.drawTime = None        # smoothed seconds per redraw
+        self.drawnAt = time.perf_counter()  # end of the last redraw
+        self.stepsSinceDraw = 0
+        self.stepsPerFrame = stepSize
+        self.drawnStep = 0          # step of the last snapshot drawn in the background
         self.parameterSetters = parameterSetters
         self.varEntries = {}
         self.statusStr = ""
+        self.background = background
+        self.modelSnapshotFunc = None
+        self.modelLock = threading.RLock()   # held while the model is stepped, reset, changed or drawn
+        self.snapshots = queue.Queue(maxsize=1)  # (step, snapshot) published for the next frame
+        self.frameWanted = threading.Event()  # set by drawLatest(), the worker then publishes after its step
+        self.frameWantedAt = 0.0
+        self.worker = None
+        self.workerStop = None      # event that ends the current worker
+        self.workerError = None
+        self.drawLatestId = None    # pending drawLatest() call, at most one
+        self.drawing = threading.Event()  # set while a frame is drawn, the worker waits between steps
+        self.modelTelemetryFunc = None
+        self.modelTelemetry = {}    # latest modelTelemetryFunc() result of a background worker
+        self.modelTelemetryAt = 0.0
+        self.telemetryLock = threading.Lock()  # guards the counters below, never held during a step or draw
+        self.stepsTimed = 0         # steps and redraws, and the seconds they took, since the last telemetry update
+        self.stepSeconds = 0.0
+        self.drawsTimed = 0
+        self.drawSeconds = 0.0
+        self.telemetryAt = time.perf_counter()
                
         self.initGUI()
         
@@ -80,11 +167,13 @@ class GUI:
         
         self.frameRun = Frame()
         self.frameSettings = Frame()
+        self.frameTelemetry = Frame()
         self.frameParameters = Frame()
         self.frameInformation = Frame()          
         
         self.notebook.add(self.frameRun,text="Run")
         self.notebook.add(self.frameSettings,text="Settings")
+        self.notebook.add(self.frameTelemetry,text="Telemetry")
         self.notebook.add(self.frameParameters,text="Parameters")
         self.notebook.add(self.frameInformation,text="Info")
         self.notebook.pack(expand=NO, fill=BOTH, padx=5, pady=5 ,side=TOP)
@@ -138,8 +227,26 @@ class GUI:
         self.showHelp(self.stepDelay,"The visualization of each step is delays by the given number of milliseconds.")
         self.stepDelay.pack(side='left')
         
+        can.pack(side='top')
+
+        can = Canvas(self.frameSettings)
+        lab = Label(can, width=25,height=1,text="Target frames per second ", justify=LEFT, anchor=W,takefocus=0)
+        lab.pack(side='left')
+        self.fpsScale = Scale(can,from_=0, to=60, resolution=1,command=self.changeTargetFPS,orient=HORIZONTAL, width=25,length=150)
+        self.fpsScale.set(self.targetFPS)
+        self.showHelp(self.fpsScale,"Chooses the step size for about [n] redraws per second,\nstepping the model as much as fits in between. 0: use the step size.")
+        self.fpsScale.pack(side='left')
+
         can.pack(side='top')
         
+        # --------------------------------------------
+        # frameTelemetry
+        # --------------------------------------------
+        self.telemetryText = StringVar(value="Not yet measured")
+        self.telemetry = Label(self.frameTelemetry, width=45, justify=LEFT, anchor=NW, font=("Courier",10),
+                               textvariable=self.telemetryText)
+        self.telemetry.pack(side=TOP, fill=BOTH, expand=YES, padx=5, pady=5)
+
         # --------------------------------------------
         # frameInformation
         # --------------------------------------------
@@ -191,14 +298,60 @@ class GUI:
     # model control functions for changing parameters
     def changeStepSize(self,val):        
         self.stepSize = int(val)
+        if self.targetFPS == 0:
+            self.stepsPerFrame = self.stepSize
         
     def changeStepDelay(self,val):        
         self.timeInterval= int(val)
+
+    def changeTargetFPS(self,val):
+        self.targetFPS = int(val)
+        self.stepScale.configure(state=DISABLED if self.targetFPS > 0 else NORMAL)
+        if self.targetFPS == 0:
+            self.stepsPerFrame = self.stepSize
+
+    def redrawDue(self):
+        if self.targetFPS <= 0:
+            return self.currentStep % self.stepSize == 0
+        # the model is stepped for what is left of the frame period after a redraw, but at
+        # least as long as a redraw takes, so a slow figure still leaves half the time to the model
+        drawTime = self.drawTime or 0.0
+        budget = max(1.0 / self.targetFPS - drawTime, drawTime)
+        self.stepsPerFrame = max(1, int(budget / self.stepTime)) if self.stepTime else 1
+        # the time limit catches a model that got slower since stepTime was measured
+        return self.stepsSinceDraw >= self.stepsPerFrame or time.perf_counter() - self.drawnAt >= budget
+
+    def updateTelemetry(self):
+        now = time.perf_counter()
+        with self.telemetryLock:  # not the model lock, a background step may take seconds
+            seconds = now - self.telemetryAt
+            lines = [('steps/s', self.stepsTimed / seconds),
+                     ('model step ms', 1000 * self.stepSeconds / self.stepsTimed if self.stepsTimed else None),
+                     ('draw ms', 1000 * self.drawSeconds / self.drawsTimed if self.drawsTimed else None)]
+            self.stepsTimed = self.drawsTimed = 0
+            self.stepSeconds = self.drawSeconds = 0.0
+            self.telemetryAt = now
+        if self.worker is None:  # the model is stepped in this thread, if at all
+            with self.modelLock:
+                model = self.modelTelemetryFunc() if self.modelTelemetryFunc else {}
+        else:
+            model = self.modelTelemetry  # published by the worker between steps
+        rss = residentMemory()
+        lines.append(('memory (RSS) MB', rss / 2**20 if rss is not None else None))
+        lines += list(model.items())
+        self.telemetryText.set('\n'.join('%-22s %10s' % (name, formatNumber(value)) for name, value in lines))
+        self.rootWindow.after(self.telemetryInterval,self.updateTelemetry)
+
+    def stepStatus(self, step):
+        if self.targetFPS > 0:
+            return "Step %d (%d steps per frame)" % (step, self.stepsPerFrame)
+        return "Step "+str(step)
         
     def saveParametersCmd(self):
-        for variableSetter in self.parameterSetters:
-            variableSetter(float(self.varEntries[variableSetter].get()))
-            self.setStatusStr("New parameter values have been set")
+        with self.modelLock:  # between two steps of a background run
+            for variableSetter in self.parameterSetters:
+                variableSetter(float(self.varEntries[variableSetter].get()))
+                self.setStatusStr("New parameter values have been set")
             
     def saveParametersAndResetCmd(self):
         self.saveParametersCmd()
@@ -209,8 +362,19 @@ class GUI:
     # This event is envoked when "Run" button is clicked.
     def runEvent(self):
         self.running = not self.running
-        if self.running:
+        if self.running and self.background:
+            self.stopWorker()
+            self.workerStop = threading.Event()
+            self.worker = threading.Thread(target=self.runWorker, args=(self.workerStop,), name='model worker', daemon=True)
+            self.drawnStep = self.currentStep
+            self.worker.start()
+            if self.drawLatestId is None:
+                self.drawLatestId = self.rootWindow.after(self.frameInterval,self.drawLatest)
+        elif self.running:
             self.rootWindow.after(self.timeInterval,self.stepModel)
+        elif self.worker is not None:
+            self.workerStop.set()  # drawLatest() shows where it stopped
+        if self.running:
             self.runPauseString.set("Pause")
             self.buttonStep.configure(state=DISABLED)
             self.buttonReset.configure(state=DISABLED)
@@ -227,17 +391,107 @@ class GUI:
 
     def stepModel(self):
         if self.running:
-            self.modelStepFunc()
-            self.currentStep += 1
-            self.setStatusStr("Step "+str(self.currentStep))
+            self.timedStep()
+            self.setStatusStr(self.stepStatus(self.currentStep))
             self.status.configure(foreground='black')
-            if (self.currentStep) % self.stepSize == 0:
+            if self.redrawDue():
                 self.drawModel()
-            self.rootWindow.after(int(self.timeInterval*1.0/self.stepSize),self.stepModel)
+            self.rootWindow.after(int(self.timeInterval*1.0/self.stepsPerFrame),self.stepModel)
+
+    def timedStep(self):
+        start = time.perf_counter()
+        self.modelStepFunc()
+        elapsed = time.perf_counter() - start
+        self.stepTime = smoothed(self.stepTime, elapsed)
+        with self.telemetryLock:
+            self.stepsTimed += 1
+            self.stepSeconds += elapsed
+        self.currentStep += 1
+        self.stepsSinceDraw += 1
+
+    # background mode: the worker steps the model, and when drawLatest() (in the Tk loop)
+    # wants a frame it publishes a snapshot right after the step in progress, so every
+    # frame shows the state at most one step old
+    def runWorker(self, stop):
+        try:
+            while not stop.is_set():
+                while self.drawing.is_set() and not stop.is_set():
+                    time.sleep(0.001)  # drawing is mostly Python code, sharing the interpreter would slow it down
+                with self.modelLock:
+                    self.timedStep()
+                    # with a target frame rate any step will do, otherwise only every stepSize-th
+                    if self.frameWanted.is_set() and (self.targetFPS > 0 or self.currentStep % self.stepSize == 0):
+                        self.frameWanted.clear()
+                        snapshot = self.modelSnapshotFunc() if self.modelSnapshotFunc else None
+                        self.snapshots.put((self.currentStep, snapshot))
+                    if self.modelTelemetryFunc and time.perf_counter() - self.modelTelemetryAt >= self.telemetryInterval / 1000.0:
+                        self.modelTelemetry = self.modelTelemetryFunc()
+                        self.modelTelemetryAt = time.perf_counter()
+                time.sleep(self.timeInterval / 1000.0)  # also lets the Tk thread take the lock
+        except Exception as e:
+            self.workerError = e
+            self.running = False
+
+    def drawLatest(self):
+        self.drawLatestId = None
+        latest = None if self.snapshots.empty() else self.snapshots.get_nowait()
+        if self.workerError is not None:
+            error, self.workerError = self.workerError, None
+            traceback.print_exception(type(error), error, error.__traceback__)
+            self.stopWorker()
+            self.runPauseString.set("Continue Run")
+            self.buttonStep.configure(state=NORMAL)
+            self.buttonReset.configure(state=NORMAL)
+            if len(self.parameterSetters) > 0:
+                self.buttonSaveParametersAndReset.configure(state=NORMAL)
+            self.setStatusStr("Model step failed: " + str(error))
+            self.status.configure(foreground='red')
+            return
+        delay = self.frameInterval
+        if latest is not None:
+            step, snapshot = latest
+            self.stepsPerFrame = max(1, step - self.drawnStep)
+            self.drawnStep = step
+            self.setStatusStr(self.stepStatus(step))
+            self.status.configure(foreground='black')
+            start = time.perf_counter()
+            self.drawing.set()
+            try:
+                self.drawModel(snapshot)
+            finally:
+                self.drawing.clear()
+            drawn = time.perf_counter() - start
+            if self.targetFPS > 0:  # the rest of the frame period since the frame was asked for, as in redrawDue()
+                delay = int(1000 * max(1.0 / self.targetFPS - (time.perf_counter() - self.frameWantedAt), drawn))
+            else:
+                # the worker waits while a frame is drawn, so frames are spaced to leave it 3/4 of the
+                # time, but at least 4 are drawn per second
+                delay = min(max(delay, int(3000 * drawn)), 250)
+        elif self.running:  # ask for the state after the step in progress and check back shortly
+            if not self.frameWanted.is_set():
+                self.frameWanted.set()
+                self.frameWantedAt = time.perf_counter()
+            delay = 5
+        if self.running:
+            self.drawLatestId = self.rootWindow.after(delay,self.drawLatest)
+        elif self.worker is not None:  # paused: show the state the worker stopped at
+            self.stopWorker()
+            self.setStatusStr("Step "+str(self.currentStep))
+            self.drawModel()
+
+    def stopWorker(self):  # waits at most for the step in progress
+        if self.worker is not None:
+            self.workerStop.set()
+            self.worker.join()
+            self.worker = None
+        self.frameWanted.clear()
+        while not self.snapshots.empty():
+            self.snapshots.get_nowait()
 
     def stepOnce(self):
         self.running = False
         self.runPauseString.set("Continue Run")
+        self.stopWorker()
         self.modelStepFunc()
         self.currentStep += 1
         self.setStatusStr("Step "+str(self.currentStep))
@@ -248,24 +502,43 @@ class GUI:
     def resetModel(self):
         self.running = False        
         self.runPauseString.set("Run")
+        self.stopWorker()
         self.modelInitFunc()
         self.currentStep = 0;
         self.setStatusStr("Model has been reset")
         self.drawModel()
 
-    def drawModel(self):
+    def drawModel(self, snapshot=None):
+        start = time.perf_counter()
         PL.ion() # bug fix by Alex Hill in 2013
         if self.modelFigure == None or self.modelFigure.canvas.manager.window == None:
             self.modelFigure = PL.figure()
-        self.modelDrawFunc()
+            PL.show() # bug fix by Hiroki Sayama in 2016
+        if self.modelSnapshotFunc is None:
+            with self.modelLock:
+                self.modelDrawFunc()
+        else:
+            if snapshot is None:
+                with self.modelLock:
+                    snapshot = self.modelSnapshotFunc()
+            self.modelDrawFunc(snapshot)
+        # a figure changed through pyplot is redrawn by interactive mode; show() is only
+        # needed for a new window, every later call would force a full redraw and undo blitting
         self.modelFigure.canvas.manager.window.update()
-        PL.show() # bug fix by Hiroki Sayama in 2016
+        self.drawnAt = time.perf_counter()
+        self.drawTime = smoothed(self.drawTime, self.drawnAt - start)
+        with self.telemetryLock:
+            self.drawsTimed += 1
+            self.drawSeconds += self.drawnAt - start
+        self.stepsSinceDraw = 0
 
-    def start(self,func=[]):
+    def start(self,func=[],snapshot=None,telemetry=None):
         if len(func)==3:
             self.modelInitFunc = func[0]
             self.modelDrawFunc = func[1]
             self.modelStepFunc = func[2]            
+            self.modelSnapshotFunc = snapshot  # observe() then gets a copy of the state: observe(snapshot)
+            self.modelTelemetryFunc = telemetry  # name -> number shown in the Telemetry tab
             if (self.modelStepFunc.__doc__ != None and len(self.modelStepFunc.__doc__)>0):
                 self.showHelp(self.buttonStep,self.modelStepFunc.__doc__.strip())                
             if (self.modelInitFunc.__doc__ != None and len(self.modelInitFunc.__doc__)>0):
@@ -276,9 +549,12 @@ class GUI:
                 
             self.modelInitFunc()
             self.drawModel()     
+            self.rootWindow.after(self.telemetryInterval,self.updateTelemetry)
         self.rootWindow.mainloop()
 
     def quitGUI(self):
+        self.running = False
+        self.stopWorker()
         PL.close('all')
         self.rootWindow.quit()
         self.rootWindow.destroy()
@@ -294,3 +570,182 @@ class GUI:
         widget.bind("<Enter>", lambda e : setText(self))
         widget.bind("<Leave>", lambda e : showHelpLeave(self))
 
+
+def smoothed(average, value, weight=0.2):  # exponential moving average, adapts within a few samples
+    return value if average is None else average + weight * (value - average)
+
+
+def residentMemory():  # bytes of physical memory used by this process, None where it cannot be read
+    try:
+        with open('/proc/self/statm') as f:  # Linux
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss
+
+
+def formatNumber(value):
+    if value is None:
+        return '-'
+    if isinstance(value, float):
+        return '%.1f' % value
+    return str(value)
+
+
+class HeadlessGUI:
+
+    ## defaults of the run, main() sets them from the command line
+    steps = 1000          # update() calls before start() returns
+    every = 100           # observe() is saved every that many steps, 0 saves the initial and final state only
+    output = 'pycx-frames'
+    imageFormat = 'png'
+    parameters = {}       # setter name -> value, applied before initialize
+    runs = 0              # start() calls so far, numbers the images when one script runs several models
+
+    def __init__(self, title='PyCX Simulator', interval=0, stepSize=1, parameterSetters=[], background=False,
+                 targetFPS=0, steps=None, every=None, output=None):
+        self.titleText = title
+        self.parameterSetters = parameterSetters
+        self.statusStr = ""
+        self.currentStep = 0
+        self.modelFigure = None
+        if steps is not None:
+            self.steps = steps
+        if every is not None:
+            self.every = every
+        if output is not None:
+            self.output = output
+
+    def setStatusStr(self, newStatus):
+        self.statusStr = newStatus
+
+    def setParameters(self):
+        for setter in self.parameterSetters:
+            setter()  # the defaults, as GUI.initGUI() does; some models rely on it to set their globals
+        setters = {setter.__name__: setter for setter in self.parameterSetters}
+        for name, value in self.parameters.items():
+            if name not in setters:
+                raise ValueError('no parameter setter %r (one of: %s)' % (name, ', '.join(setters) or 'none'))
+            setters[name](float(value))
+
+    def drawModel(self):
+        PL.figure(self.modelFigure.number)  # observe() draws into the current figure
+        if self.modelSnapshotFunc is None:
+            self.modelDrawFunc()
+        else:
+            self.modelDrawFunc(self.modelSnapshotFunc())
+        path = os.path.join(self.output, 'run%d_step%06d.%s' % (self.run, self.currentStep, self.imageFormat))
+        self.modelFigure.savefig(path)
+        return path
+
+    def start(self, func=[], snapshot=None, telemetry=None):
+        if len(func) != 3:
+            return
+        self.modelInitFunc, self.modelDrawFunc, self.modelStepFunc = func
+        self.modelSnapshotFunc = snapshot
+        HeadlessGUI.runs += 1
+        self.run = HeadlessGUI.runs
+        os.makedirs(self.output, exist_ok=True)
+        importPylab()
+        self.modelFigure = PL.figure()
+        self.setParameters()
+        self.modelInitFunc()
+        self.currentStep = 0
+        self.drawModel()
+        started = time.perf_counter()
+        while self.currentStep < self.steps:
+            self.modelStepFunc()
+            self.currentStep += 1
+            if (self.every > 0 and self.currentStep % self.every == 0) or self.currentStep == self.steps:
+                path = self.drawModel()
+                print('%s: step %d, %.1f steps/s, %s' % (self.titleText, self.currentStep,
+                                                         self.currentStep / (time.perf_counter() - started), path))
+        PL.close(self.modelFigure)
+
+
+def notebookCells(path):  # sources of the code cells of a notebook, without IPython magics and shell commands
+    with open(path, encoding='utf-8') as f:
+        cells = json.load(f)['cells']
+    sources = []
+    for cell in cells:
+        if cell['cell_type'] == 'code':
+            source = cell['source']
+            source = ''.join(source) if isinstance(source, list) else source
+            sources.append('\n'.join(line for line in source.splitlines() if not line.lstrip().startswith(('%', '!'))))
+    return sources
+
+
+def cellNumbers(text, count):  # '9,10', '3-5' or '9-' -> set of code cell numbers out of 1..count
+    numbers = set()
+    for part in text.split(','):
+        first, dash, last = part.strip().partition('-')
+        try:
+            first = int(first)
+            last = (int(last) if last else count) if dash else first
+        except ValueError:
+            raise ValueError('expected cell numbers like 9,10 or 3-5, got %r' % text)
+        if not 1 <= first <= last <= count:
+            raise ValueError('cells %r out of range, the notebook has %d code cells' % (part.strip(), count))
+        numbers.update(range(first, last + 1))
+    return numbers
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run a PyCX model without a window, saving observe() to images.')
+    parser.add_argument('model', help='model script (.py) or notebook (.ipynb)')
+    parser.add_argument('--steps', type=int, default=HeadlessGUI.steps, help='number of update() steps')
+    parser.add_argument('--every', type=int, default=HeadlessGUI.every,
+                        help='save observe() every that many steps (0: first and last state only)')
+    parser.add_argument('--output', default=HeadlessGUI.output, help='directory for the images')
+    parser.add_argument('--format', default=HeadlessGUI.imageFormat, help='image format, e.g. png, svg, pdf')
+    parser.add_argument('--cells', metavar='LIST',
+                        help='notebook code cells to run, numbered from 1, e.g. 9,10 or 3-5 or 9- (default: all)')
+    parser.add_argument('--set', dest='params', action='append', default=[], metavar='NAME=VALUE',
+                        help='call the parameter setter NAME with VALUE before initialize, may be repeated')
+    args = parser.parse_args(argv)
+
+    parameters = {}
+    for assignment in args.params:
+        name, sep, value = assignment.partition('=')
+        if not sep:
+            parser.error('expected NAME=VALUE, got %r' % assignment)
+        parameters[name.strip()] = value.strip()
+
+    cells = None
+    if args.cells:
+        if not args.model.endswith('.ipynb'):
+            parser.error('--cells needs a notebook')
+        try:
+            cells = cellNumbers(args.cells, len(notebookCells(args.model)))
+        except ValueError as e:
+            parser.error(str(e))
+
+    import matplotlib
+    matplotlib.use('Agg', force=True)
+    matplotlib.use = lambda *args, **kwargs: None  # models ask for TkAgg before importing this module
+
+    # the model imports this module as pycxsimulator, which must be the patched one
+    module = sys.modules[__name__]
+    sys.modules['pycxsimulator'] = module
+    HeadlessGUI.steps, HeadlessGUI.every, HeadlessGUI.output = args.steps, args.every, args.output
+    HeadlessGUI.imageFormat, HeadlessGUI.parameters = args.format, parameters
+    module.GUI = HeadlessGUI
+
+    path = os.path.abspath(args.model)
+    sys.path.insert(0, os.path.dirname(path))  # for the model's own modules
+    sys.argv = [path]
+    if path.endswith('.ipynb'):
+        namespace = {'__name__': '__main__', '__file__': path}
+        for number, source in enumerate(notebookCells(path), 1):
+            if cells is None or number in cells:
+                exec(compile(source, '%s, code cell %d' % (path, number), 'exec'), namespace)
+    else:
+        runpy.run_path(path, run_name='__main__')
+
+
+if __name__ == '__main__':
+    main()
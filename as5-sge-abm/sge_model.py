@@ -0,0 +1,523 @@
+import copy
+import time as clock
+
+import numpy as np
+
+from concentration_field import ConcentrationField
+import exact_expression
+from population_stats import Histogram, PopulationStats
+
+'''
+AGENTS
+'''
+
+class AgentStore:
+    # columnar store of agents: one contiguous NumPy array per state variable,
+    # rows [0, size) are in use, the rest is spare capacity for appending
+    columns = {}  # column name -> (dtype, default value for new agents)
+    
+    def __init__(self, capacity=64):
+        self.size = 0
+        self.data = {name: np.empty(capacity, dtype=dtype) for name, (dtype, _) in self.columns.items()}
+        
+    def __len__(self):
+        return self.size
+    
+    def __getattr__(self, name):  # view on the rows in use, e.g. bacteria.x
+        data = self.__dict__.get('data')
+        if data is None or name not in data:
+            raise AttributeError(name)
+        return data[name][:self.size]
+    
+    def capacity(self):
+        return len(self.data[next(iter(self.columns))])
+    
+    def reserve(self, capacity):  # grow the arrays geometrically so appends are amortized O(1)
+        if capacity <= self.capacity():
+            return
+        capacity = max(capacity, 2 * self.capacity())
+        for name, arr in self.data.items():
+            new_arr = np.empty(capacity, dtype=arr.dtype)
+            new_arr[:self.size] = arr[:self.size]
+            self.data[name] = new_arr
+            
+    def append(self, **values):  # add agents; every column not given gets its default
+        n = len(np.atleast_1d(next(iter(values.values()))))
+        self.reserve(self.size + n)
+        for name, (_, default) in self.columns.items():
+            self.data[name][self.size:self.size + n] = values.get(name, default)
+        self.size += n
+        
+    def compact(self, keep):  # drop the rows where keep is False, preserving order
+        keep = np.array(keep, dtype=bool)  # copy, keep may be a view on one of the columns
+        n = int(np.count_nonzero(keep))
+        if n == self.size:
+            return
+        for name, arr in self.data.items():
+            arr[:n] = arr[:self.size][keep]
+        self.size = n
+        
+    def reorder(self, order):  # permute the rows in use, order as returned by argsort
+        for name, arr in self.data.items():
+            arr[:self.size] = arr[:self.size][order]
+            
+    def copy(self):  # independent store holding the rows in use
+        store = copy.copy(self)
+        store.data = {name: arr[:self.size].copy() for name, arr in self.data.items()}
+        return store
+        
+    
+class Bacteria(AgentStore):
+    columns = {
+        'x': (np.float64, np.nan),  # coordinates
+        'y': (np.float64, np.nan),
+        'prot_activ': (np.bool_, False),  # indicator variable if promoter is active
+        'mrna_count': (np.int64, 100),
+        'prot_count': (np.int64, 1),
+        'age': (np.int64, 0),
+        'alive': (np.bool_, True),
+        'id': (np.int64, -1),  # stable identifier, survives compaction
+    }
+    
+    def __init__(self, capacity=64):
+        super().__init__(capacity)
+        self.next_id = 0
+        
+    def new_ids(self, n):  # reserve n fresh identifiers for cells about to be added
+        ids = np.arange(self.next_id, self.next_id + n)
+        self.next_id += n
+        return ids
+    
+class Antibiotics(AgentStore):
+    columns = {
+        'x': (np.float64, np.nan),  # coordinates
+        'y': (np.float64, np.nan),
+        'used': (np.bool_, False),  # if the molecule is consumed by an E. coli nearby
+    }
+    
+
+'''
+SPATIAL INDEX
+'''
+
+def kdtree(points):  # SciPy is imported on first use, so importing the model only needs NumPy
+    from scipy.spatial import cKDTree
+    return cKDTree(points, balanced_tree=False)  # sliding midpoint splits, much faster to build than median splits
+
+def morton_order(x, y, cell):
+    # permutation sorting points along a Z-order curve over a grid of the given
+    # cell size, so that points close in space end up close in memory
+    def spread(v):  # insert a zero bit between the bits of v
+        v &= np.uint64(0xFFFFFFFF)
+        for shift, mask in ((16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF), (4, 0x0F0F0F0F0F0F0F0F),
+                            (2, 0x3333333333333333), (1, 0x5555555555555555)):
+            v = (v | (v << np.uint64(shift))) & np.uint64(mask)
+        return v
+    
+    key = spread((x / cell).astype(np.uint64)) | (spread((y / cell).astype(np.uint64)) << np.uint64(1))
+    return np.argsort(key, kind='stable')
+
+def close_pairs(points, others=None, radius=None):
+    # index pairs (i, j) closer than radius: points[i] and others[j], or two
+    # distinct points (i < j) when others is None
+    tree = kdtree(points)
+    if others is None:
+        pairs = tree.query_pairs(radius, output_type='ndarray')
+        i, j = pairs[:, 0], pairs[:, 1]
+        others = points
+    else:
+        pairs = tree.sparse_distance_matrix(kdtree(others), radius, output_type='ndarray')
+        i, j = pairs['i'], pairs['j']
+    close = ((points[i] - others[j])**2).sum(axis=1) < radius**2  # the tree includes the radius itself
+    return i[close], j[close]
+
+
+'''
+MODEL
+'''
+
+# tunable parameters and their types, as used by the batch tools
+PARAMETERS = {
+    'prot_activ_prob': float, 'prot_deactiv_prob': float, 'mrna_synth_rate': int, 'mrna_degr_prob': float,
+    'prot_synth_prob': float, 'prot_degr_prob': float, 'expression_mode': int,
+    'n_pop': int, 'move_rad': float, 'div_prob': float, 'lifetime': int, 'min_dist': float,
+    'divide_rad_std': float, 'max_divide_attempts': int,
+    'add_antibiotic': int, 'n_molec': int, 'kill_radius': float, 'kill_prot_thres': int, 'intro_period': int,
+    'antibiotic_field': int, 'field_spacing': float, 'diffusion_coef': float, 'antibiotic_decay': float,
+    'x_size': float, 'y_size': float, 'sort_period': int,
+}
+
+
+class SGEModel:
+    # one simulation: the parameters below are defaults that an instance can
+    # override (SGEModel(n_pop=500), set_parameters()), and all state lives in
+    # the instance, so any number of models can run side by side in one process
+    
+    # Parameters for stochastic gene expression 
+    #
+    prot_activ_prob = 0.1  # probability of activation of promoter from inactive state
+    prot_deactiv_prob = 0.6  # probability of deactivation of promoter from active state
+    
+    mrna_synth_rate = 100  # rate of mRNA transcription given active promoter (count / timestep)
+    mrna_degr_prob = 0.2  # probability of mRNA degradation
+    prot_synth_prob = 0.2#0.1  # probability of translation mRNA to protein
+    prot_degr_prob = 0.005  # probability of protein degradation
+    expression_mode = 0  # 0 - per-timestep probabilities, 1 - exact continuous-time process (see exact_expression.py)
+    
+    # Parameters for population behavior
+    #
+    n_pop = 50  # number of bacteria in the simulation
+    move_rad = 1  # radius of random movement of bacteria
+    div_prob = 0.05  # probability of cell division
+    lifetime = 50 
+    min_dist = 1.5  # minimal distance between two bacteria (object avoidance)
+    divide_rad_std = 3  # standard deviation of normal on position of the dividing cell
+                        # to determine the 2nd offspring location
+    max_divide_attempts = 10  # attempts to divide if there is no free space around
+    
+    # Parameters for antibiotic treatment
+    #
+    add_antibiotic = 2  # 0 - no antibiotic, 1 - add randomly, 2 - droplet
+    n_molec = 65  # number of antibiotic molecules
+    kill_radius = 3  # radius at which the antibiotic has effect
+    kill_prot_thres = 40 # minimum number of antibiotic-resistant proteins for bacteria to survive
+    intro_period = 20  # number of timesteps to introduce antibiotic molecules to the system
+    antibiotic_field = 0  # 0 - discrete molecules, 1 - diffusing concentration field (see concentration_field.py)
+    field_spacing = 1  # lattice spacing of the concentration field
+    diffusion_coef = 0.5  # diffusion coefficient of the antibiotic in the field (area / timestep)
+    antibiotic_decay = 0.01  # fraction of the antibiotic in the field degraded per timestep
+    
+    # Simulation parameters
+    # 
+    x_size = 50  # width of petri dish
+    y_size = 50  # height of petri dish
+    sort_period = 0  # reorder bacteria by position every sort_period steps (0 - never), speeds up large dishes
+    history_length = 10000  # number of steps kept in the recorded statistics
+    
+    def __init__(self, seed=None, **params):  # seed: int, np.random.SeedSequence, or None for fresh OS entropy
+        self.set_parameters(**params)
+        self.rng = np.random.default_rng(seed)  # random number stream of the simulation
+        self.profiler = None  # profiling.PhaseProfiler to time the phases of update(), None when off
+        self.recorder = None  # trajectory.TrajectoryWriter receiving every cell at every step, None when off
+        
+        # cells of neighbouring domains when the dish is split over processes (see domains.py), None otherwise
+        self.halo_points = None  # positions (m x 2) of cells owned by other domains, avoided like local cells
+        self.halo_targets = None  # move targets of neighbouring cells that take precedence over the local ones
+        self.halo_range = None  # (x_low, x_high) where the halo is complete, offspring are only placed inside
+        
+    def get_parameters(self):
+        return {name: getattr(self, name) for name in PARAMETERS}
+    
+    def set_parameters(self, **params):  # set parameters by name, values may be numbers or strings
+        for name, val in params.items():
+            if name not in PARAMETERS:
+                raise ValueError('unknown parameter: ' + name)
+            setattr(self, name, PARAMETERS[name](float(val)))  # ints go through float like the GUI setters
+            
+    def seed(self, seed=None):  # restart the random number stream
+        self.rng = np.random.default_rng(seed)
+        
+    def snapshot(self):
+        # copy of the parameters, population, antibiotics and statistics that stays
+        # as it is while the model goes on, e.g. to draw it while update() runs in another thread
+        view = copy.copy(self)
+        view.bacteria = self.bacteria.copy()
+        view.antibiotics = self.antibiotics.copy()
+        if self.field is not None:
+            view.field = copy.copy(self.field)
+            view.field.values = self.field.values.copy()
+        view.stats = self.stats.snapshot()
+        view.bacteria_tree = view.antibiotics_tree = None
+        view.rng = view.profiler = view.recorder = None
+        return view
+
+    def telemetry(self):  # agent counts and, when profiled, ms per phase over the last 50 steps, e.g. for the GUI
+        values = {'cells': len(self.bacteria), 'antibiotic molecules': len(self.antibiotics)}
+        if self.profiler:
+            for phase, seconds in self.profiler.mean_seconds(last=50).items():
+                values[phase + ' ms'] = 1000 * seconds
+        return values
+        
+    '''
+    SIMULATION DYNAMICS
+    '''
+    
+    def initialize(self):
+        self.antibiotics = Antibiotics()
+        self.antibiotics_tree = None  # KD-tree over antibiotics, rebuilt lazily after they change
+        self.field = ConcentrationField(self.x_size, self.y_size, self.field_spacing) if self.antibiotic_field else None
+        self.time = 1
+    
+        self.bacteria = self.new_population()
+        self.bacteria_tree = None  # KD-tree over bacteria positions, rebuilt lazily after they change
+        if self.sort_period:
+            self.sort_bacteria()
+    
+        self.stats = self.new_stats()
+        self.stats.record(0, self.bacteria)
+        if self.recorder:
+            self.recorder.record(0, self.bacteria)
+
+    def effective_kill_radius(self):  # kill_radius as applied; the parameter itself is never changed
+        if self.add_antibiotic == 2 and not self.antibiotic_field:
+            return 3 * self.kill_radius  # increase kill radius to simulate dissolve (the field models it by diffusion)
+        return self.kill_radius
+    
+    def new_population(self):  # the n_pop cells at the start, spread uniformly over the dish
+        bacteria = Bacteria(capacity=max(64, 2 * self.n_pop))
+        bacteria.append(x=self.rng.uniform(0, self.x_size, self.n_pop),
+                        y=self.rng.uniform(0, self.y_size, self.n_pop), id=bacteria.new_ids(self.n_pop))
+        return bacteria
+    
+    def new_stats(self):  # statistics recorded every step: mean, std and histogram of these columns
+        return PopulationStats({
+            'prot': ('prot_count', Histogram(0, 1000, 100)),
+            'mrna': ('mrna_count', Histogram(0, 500, 100)),
+            'age': ('age', Histogram(0, self.lifetime + 2, self.lifetime + 2)),
+        }, history=self.history_length)
+    
+    def update(self):
+        prof = self.profiler
+        if prof: prof.begin_step(self.time, len(self.bacteria))
+    
+        if self.time % self.intro_period == 0:
+            if self.add_antibiotic == 1:
+                self.add_antibiotics_random()
+            elif self.add_antibiotic == 2:
+                self.add_antibiotics_droplet()
+        if prof: prof.mark('dosing')
+    
+        if self.field is not None:
+            self.field.step(self.diffusion_coef, self.antibiotic_decay)
+            if prof: prof.mark('diffusion')
+    
+        if self.sort_period and self.time % self.sort_period == 0:
+            self.sort_bacteria()
+            if prof: prof.mark('sort')
+    
+        self.biosynth_all()  # gene expression for the whole population at once
+        if prof: prof.mark('biosynth')
+    
+        n = len(self.bacteria)  # cells born during this step are not updated until the next one
+        self.move(n)
+        if prof: prof.mark('move')
+    
+        self.divide(n)
+        if prof: prof.mark('divide')
+    
+        self.check_survival(n)
+        if prof: prof.mark('survival')
+    
+        self.clear_bacteria()  # remove dead bacteria
+        self.clear_antibiotics()  # remove used antibiotics
+        if prof: prof.mark('clear')
+    
+        self.stats.record(self.time, self.bacteria)
+        if prof: prof.mark('stats')
+    
+        if self.recorder:
+            self.recorder.record(self.time, self.bacteria)
+            if prof: prof.mark('record')
+        if prof: prof.end_step()
+        self.time += 1
+    
+    def add_antibiotics_random(self):
+        self.antibiotics_tree = None
+        x, y = self.rng.uniform(0, self.x_size, self.n_molec), self.rng.uniform(0, self.y_size, self.n_molec)
+        if self.field is not None:
+            self.field.deposit(x, y)
+        else:
+            self.antibiotics.append(x=x, y=y)
+    
+    def add_antibiotics_droplet(self):
+        self.antibiotics_tree = None
+        x, y = self.rng.uniform(0, self.x_size), self.rng.uniform(0, self.y_size)
+        if self.field is not None:
+            self.field.deposit(x, y, self.n_molec)  # the whole dose at one spot, it spreads by diffusion
+        else:
+            self.antibiotics.append(x=x, y=y)
+    
+    def biosynth_all(self):  # update mRNA and protein counts of every bacterium in place
+        bacteria = self.bacteria
+        if self.expression_mode == 1:
+            rate = exact_expression.rates(self.prot_activ_prob, self.prot_deactiv_prob, self.mrna_synth_rate,
+                                          self.mrna_degr_prob, self.prot_synth_prob, self.prot_degr_prob)
+            bacteria.prot_activ[:], bacteria.mrna_count[:], bacteria.prot_count[:] = exact_expression.advance(
+                bacteria.prot_activ, bacteria.mrna_count, bacteria.prot_count, rate, self.rng)
+        else:
+            bacteria.prot_activ[:], bacteria.mrna_count[:], bacteria.prot_count[:] = self.biosynth(
+                bacteria.prot_activ, bacteria.mrna_count, bacteria.prot_count)
+    
+    def biosynth(self, prot_activ, mrna_counts, prot_counts):
+        # update mRNA and protein counts (arrays, one entry per cell)
+        # transcription
+        switch = self.rng.random(prot_activ.shape)
+        mrna_counts = mrna_counts + np.where(prot_activ, self.mrna_synth_rate, 0)
+        prot_activ = np.where(prot_activ, switch >= self.prot_deactiv_prob, switch < self.prot_activ_prob)
+    
+        # translation and degradation of mRNA
+        # every molecule independently degrades, is translated or stays, so the
+        # per-molecule rolls of a cell add up to one multinomial draw, which is
+        # split here into two binomials to vectorize over cells
+        mrna_degr = self.rng.binomial(mrna_counts, self.mrna_degr_prob)
+        if self.mrna_degr_prob < 1:
+            trans_prob = min(self.prot_synth_prob / (1 - self.mrna_degr_prob), 1)
+            mrna_trans = self.rng.binomial(mrna_counts - mrna_degr, trans_prob)
+        else:
+            mrna_trans = np.zeros_like(mrna_counts)
+    
+        mrna_counts = mrna_counts - mrna_degr - mrna_trans
+    
+        # synthesis and degradation of proteins
+        prot_degr = self.rng.binomial(prot_counts, self.prot_degr_prob)
+        prot_counts = prot_counts + mrna_trans - prot_degr
+    
+        return prot_activ, mrna_counts, prot_counts
+    
+    def move_targets(self, n):  # random target positions of the first n bacteria
+        new_x = self.bacteria.x[:n] + self.rng.uniform(-self.move_rad, self.move_rad, n)
+        new_y = self.bacteria.y[:n] + self.rng.uniform(-self.move_rad, self.move_rad, n)
+        return np.column_stack(self.clip_to_dish(new_x, new_y, slice(0, n)))
+    
+    def clip_to_dish(self, x, y, rows):  # clip positions meant for the given bacteria (or their offspring) to the dish
+        return np.clip(x, 0, self.x_size), np.clip(y, 0, self.y_size)
+    
+    def move(self, n, targets=None):  # move the first n bacteria in the medium, all at once
+        if n == 0:
+            return
+        if targets is None:
+            targets = self.move_targets(n)
+        new_x, new_y = targets[:, 0], targets[:, 1]
+    
+        # a cell stays put if its target is closer than min_dist to the current
+        # position of any other cell, or to the target of a lower-numbered cell;
+        # the accepted targets then keep min_dist to each other and to every
+        # cell that does not move
+        free = self.check_free_space(targets, exclude=np.arange(n))
+        i, j = close_pairs(targets, radius=self.min_dist)
+        free[j] = False
+        if self.halo_targets is not None and len(self.halo_targets) > 0:
+            i, j = close_pairs(targets, self.halo_targets, self.min_dist)
+            free[i] = False
+    
+        self.bacteria.x[:n][free] = new_x[free]
+        self.bacteria.y[:n][free] = new_y[free]
+        self.bacteria_tree = None
+    
+    def divide(self, n):  # cell division of the first n bacteria -> create new cells nearby
+        parents = np.flatnonzero(self.rng.random(n) < self.div_prob)
+        new_xs = np.empty(0)
+        new_ys = np.empty(0)
+        born = np.empty(0, dtype=np.int64)  # parent of each offspring
+    
+        # every round draws one candidate position for each parent still without
+        # offspring; a candidate is kept if it has min_dist to all cells, to the
+        # offspring placed in earlier rounds and to the kept candidates of
+        # lower-numbered parents in the same round
+        for attempt in range(self.max_divide_attempts):
+            if len(parents) == 0:
+                break
+            cand_x, cand_y = self.clip_to_dish(self.rng.normal(self.bacteria.x[parents], self.divide_rad_std),
+                                               self.rng.normal(self.bacteria.y[parents], self.divide_rad_std), parents)
+            candidates = np.column_stack((cand_x, cand_y))
+    
+            free = self.check_free_space(candidates)
+            if self.halo_range is not None:
+                free &= (cand_x >= self.halo_range[0]) & (cand_x < self.halo_range[1])
+            if len(new_xs) > 0:
+                i, j = close_pairs(candidates, np.column_stack((new_xs, new_ys)), self.min_dist)
+                free[i] = False
+            i, j = close_pairs(candidates, radius=self.min_dist)  # i < j, sorted so earlier decisions come first
+            for k in np.argsort(i, kind='stable'):
+                if free[i[k]]:
+                    free[j[k]] = False
+    
+            new_xs = np.concatenate((new_xs, cand_x[free]))
+            new_ys = np.concatenate((new_ys, cand_y[free]))
+            born = np.concatenate((born, parents[free]))
+            parents = parents[~free]
+    
+        if len(new_xs) > 0:
+            self.bacteria.append(x=new_xs, y=new_ys, id=self.bacteria.new_ids(len(new_xs)),
+                                 **self.inherited(born))
+            self.bacteria_tree = None
+    
+    def inherited(self, parents):  # columns that offspring take over from their parents, none here
+        return {}
+    
+    def check_free_space(self, points, exclude=None):
+        # for each point, True if no bacterium is closer than min_dist; the
+        # bacterium in row exclude[k] (e.g. the one moving there) is ignored for point k
+        if self.profiler:
+            start = clock.perf_counter()
+        if self.bacteria_tree is None:
+            cells = np.column_stack((self.bacteria.x, self.bacteria.y))
+            if self.halo_points is not None:
+                # after the local rows, so exclude indices stay valid
+                cells = np.concatenate((cells, self.halo_points))
+            self.bacteria_tree = kdtree(cells)
+        if exclude is None:
+            dist, nearest = self.bacteria_tree.query(points, distance_upper_bound=self.min_dist)
+        else:
+            # the closest bacterium may be the excluded one, then the second closest decides
+            dist, nearest = self.bacteria_tree.query(points, k=2, distance_upper_bound=self.min_dist)
+            dist = np.where(nearest[:, 0] == exclude, dist[:, 1], dist[:, 0])
+        free = np.isinf(dist)
+        if self.profiler:
+            self.profiler.add('check_free_space', clock.perf_counter() - start, calls=len(points))
+        return free
+    
+    def check_survival(self, n):  # check the first n bacteria for old age and antibiotics nearby
+        age = self.bacteria.age[:n]
+        self.bacteria.alive[:n] &= age <= self.lifetime
+        age += 1
+    
+        if self.field is not None:
+            # kill probability from the molecules in the kill disc around each cell; every kill
+            # consumes one, so the hits are resolved one by one, in random order, each thinned by
+            # what the kills before it left in its disc
+            susceptible = np.flatnonzero(self.bacteria.prot_count[:n] < self.kill_prot_thres)
+            x, y = self.bacteria.x[susceptible], self.bacteria.y[susceptible]
+            radius = self.effective_kill_radius()
+            kill_prob = -np.expm1(-self.field.disc_masses(radius)[self.field.sites(x, y)])
+            hit = np.flatnonzero(self.rng.random(len(susceptible)) < kill_prob)
+            for i in self.rng.permutation(hit):
+                left_prob = -np.expm1(-self.field.disc_mass(x[i], y[i], radius))
+                if self.rng.random() * kill_prob[i] < left_prob and self.field.consume(x[i], y[i], radius):
+                    self.bacteria.alive[susceptible[i]] = False
+            return
+        if len(self.antibiotics) == 0:
+            return
+        if self.antibiotics_tree is None:
+            self.antibiotics_tree = kdtree(np.column_stack((self.antibiotics.x, self.antibiotics.y)))
+    
+        # one batched nearest-neighbour query for all susceptible cells; a killed
+        # cell consumes the closest molecule within kill_radius (the tree bound is
+        # exclusive, nextafter makes it match the inclusive distance check)
+        susceptible = np.flatnonzero(self.bacteria.prot_count[:n] < self.kill_prot_thres)
+        dist, nearest = self.antibiotics_tree.query(
+            np.column_stack((self.bacteria.x[susceptible], self.bacteria.y[susceptible])),
+            distance_upper_bound=np.nextafter(self.effective_kill_radius(), np.inf))
+        hit = np.isfinite(dist)
+        self.bacteria.alive[susceptible[hit]] = False
+        self.antibiotics.used[nearest[hit]] = True
+    
+    def sort_bacteria(self):
+        # with 10^5 and more cells the neighbour queries are limited by memory
+        # access, which is much faster when neighbours are stored close together
+        self.bacteria.reorder(morton_order(self.bacteria.x, self.bacteria.y, 4 * self.min_dist))
+        self.bacteria_tree = None
+    
+    def clear_bacteria(self):  # clear dead bacteria
+        if not np.all(self.bacteria.alive):
+            self.bacteria.compact(self.bacteria.alive)
+            self.bacteria_tree = None
+    
+    
+    def clear_antibiotics(self):  # clear used antibiotics
+        if self.add_antibiotic == 1 and np.any(self.antibiotics.used):
+            self.antibiotics.compact(~self.antibiotics.used)
+            self.antibiotics_tree = None
+    
+    def count_alive(self):
+        return int(np.count_nonzero(self.bacteria.alive))
@@ -0,0 +1,126 @@
+## Parameter sweep executor for the SGE-ABM model
+##
+## Fans parameter combinations x replicate seeds out over a process pool and
+## collects one row of summary metrics per run into a CSV table:
+##
+##   python sweep.py --grid kill_prot_thres=20,40,60 --grid n_molec=65,130 --replicates 10 -o sweep.csv
+##   python sweep.py --runs combinations.json --replicates 5 -o sweep.csv
+##
+## where combinations.json holds a list of {"name": value, ...} objects. With
+## --ensemble the replicates of a combination run in lockstep as one
+## ensemble.Ensemble in a single worker, which pays off for many replicates of
+## small dishes (the replicates then share one random stream, see ensemble.py).
+
+import argparse
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+
+import numpy as np
+
+import ensemble
+import headless
+import sge_model
+
+
+def grid(**values):  # grid(a=[1, 2], b=[3]) -> [{'a': 1, 'b': 3}, {'a': 2, 'b': 3}]
+    names = list(values)
+    return [dict(zip(names, combination)) for combination in itertools.product(*values.values())]
+
+
+def summarize(results):
+    cell_counts = results['cell_counts']
+    extinct = np.flatnonzero(cell_counts == 0)
+    prot_means = results['prot_means'][cell_counts > 0]
+    return {
+        'steps': results['steps'],
+        'final_cell_count': int(cell_counts[-1]),
+        'extinction_time': int(extinct[0]) if len(extinct) > 0 else '',
+        'final_prot_mean': float(prot_means[-1]) if len(prot_means) > 0 else '',
+        'mean_prot_mean': float(np.mean(prot_means)) if len(prot_means) > 0 else '',
+        'max_cell_count': int(np.max(cell_counts)),
+    }
+
+
+def run_one(task):
+    run, params, replicate, seed, steps = task
+    results = headless.run(steps, seed, params)
+    return dict(run=run, seed=seed.entropy, replicate=replicate, **params, **summarize(results))
+
+
+def run_ensemble(task):  # all replicates of one combination, one row each
+    run, params, replicates, seed, steps = task
+    results = ensemble.run(steps, replicates, seed, params)
+    rows = []
+    for replicate in range(replicates):
+        part = {'steps': results['steps'], 'cell_counts': results['cell_counts'][:, replicate],
+                'prot_means': results['prot_means'][:, replicate]}
+        rows.append(dict(run=run + replicate, seed=seed.entropy, replicate=replicate, **params, **summarize(part)))
+    return rows
+
+
+def sweep(combinations, replicates=1, steps=200, seed=None, processes=None, lockstep=False):
+    # replicate r of every combination uses child stream r spawned from seed, so
+    # the combinations are compared on common random numbers; rows come back in run order;
+    # lockstep=True runs the replicates of a combination as one ensemble, all ensembles use the same stream
+    streams = headless.seed_sequence(seed).spawn(replicates)
+    processes = processes or os.cpu_count()
+    with multiprocessing.Pool(processes) as pool:
+        if lockstep:
+            tasks = [(run * replicates, params, replicates, streams[0], steps) for run, params in enumerate(combinations)]
+            rows = [row for rows in pool.imap_unordered(run_ensemble, tasks) for row in rows]
+        else:
+            tasks = [(run, params, replicate, streams[replicate], steps)
+                     for run, (params, replicate) in enumerate(itertools.product(combinations, range(replicates)))]
+            chunksize = max(1, len(tasks) // (4 * processes))
+            rows = list(pool.imap_unordered(run_one, tasks, chunksize))
+    return sorted(rows, key=lambda row: row['run'])
+
+
+def write_table(rows, path):
+    fields = []
+    for row in rows:
+        fields += [name for name in row if name not in fields]
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Sweep SGE-ABM parameters over a process pool.')
+    parser.add_argument('--grid', action='append', default=[], metavar='NAME=V1,V2,...',
+                        help='values of one parameter, the sweep runs the product of all --grid options')
+    parser.add_argument('--runs', metavar='FILE', help='JSON list of parameter combinations, instead of --grid')
+    parser.add_argument('--replicates', type=int, default=1, help='seeds per combination')
+    parser.add_argument('--steps', type=int, default=200, help='number of update() steps per run')
+    parser.add_argument('--seed', type=int, default=0, help='root seed the replicate streams are spawned from')
+    parser.add_argument('--processes', type=int, default=None, help='worker processes (default: all cores)')
+    parser.add_argument('--ensemble', action='store_true',
+                        help='run the replicates of a combination in lockstep in one worker (see ensemble.py)')
+    parser.add_argument('-o', '--output', default='sge-abm-sweep.csv', help='output CSV table')
+    args = parser.parse_args(argv)
+
+    try:
+        if args.runs:
+            with open(args.runs) as f:
+                combinations = json.load(f)
+        else:
+            values = headless.parse_assignments(args.grid)
+            combinations = grid(**{name: val.split(',') for name, val in values.items()})
+        for params in combinations:
+            model = sge_model.SGEModel(**params)  # validate before starting the pool
+            if args.ensemble and model.antibiotic_field:
+                raise ValueError('the antibiotic concentration field is not supported with --ensemble')
+    except ValueError as e:
+        parser.error(str(e))
+
+    rows = sweep(combinations, args.replicates, args.steps, args.seed, args.processes, args.ensemble)
+    write_table(rows, args.output)
+    print('%d runs written to %s' % (len(rows), args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,239 @@
+## On-disk trajectories of every cell for the SGE-ABM model
+##
+## TrajectoryWriter appends a snapshot of the whole population (id, x, y,
+## mRNA, protein, age) per step to one append-only file. Snapshots are grouped
+## into chunks; every column of a chunk is stored as its own zlib-compressed
+## block, so a chunk can be read back column by column. Copying the columns is
+## all that happens in the simulation thread -- compression and writing run in
+## a background thread, behind a queue of bounded length, so memory stays
+## bounded (at most max_pending snapshots plus one chunk) however long the run.
+##
+## File layout:
+##
+##   b'SGETRAJ1'
+##   chunk*      uint64 header length, JSON header (steps, row offsets,
+##               column dtypes and block sizes), compressed column blocks
+##   footer      JSON step index, uint64 footer length, b'SGEINDEX'
+##
+## The footer is written by close(). A file without one (a run that was
+## killed) is still readable: TrajectoryReader then rebuilds the index by
+## scanning the chunk headers. TrajectoryReader gives random access by step:
+##
+##   with TrajectoryReader('run.traj') as traj:
+##       cells = traj.snapshot(120)  # dict of column arrays
+##       cells['x'], cells['prot_count']
+
+import json
+import os
+import queue
+import struct
+import threading
+import zlib
+
+import numpy as np
+
+MAGIC = b'SGETRAJ1'
+INDEX_MAGIC = b'SGEINDEX'
+COLUMNS = ('id', 'x', 'y', 'mrna_count', 'prot_count', 'age')
+LENGTH = struct.Struct('<Q')
+
+
+class TrajectoryWriter:
+    def __init__(self, path, columns=COLUMNS, chunk_steps=50, chunk_rows=1 << 20, level=1, max_pending=4,
+                 append=False):
+        # a chunk is written once it holds chunk_steps snapshots or chunk_rows cells;
+        # append=True continues an existing file, a step recorded again replaces the earlier snapshot in the index
+        self.columns = tuple(columns)
+        self.chunk_steps = chunk_steps
+        self.chunk_rows = chunk_rows
+        self.level = level
+        self.index = {}  # step -> (chunk file offset, first row, number of rows)
+        self.error = None
+
+        if append and os.path.exists(path):
+            with TrajectoryReader(path) as reader:
+                if reader.columns != self.columns:
+                    raise ValueError('%s holds columns %s, not %s' % (path, reader.columns, self.columns))
+                self.index = dict(reader.index)
+                end = reader.data_end
+            self.file = open(path, 'r+b')
+            self.file.truncate(end)  # drop the old footer, chunks are appended after the last one
+            self.file.seek(end)
+        else:
+            self.file = open(path, 'wb')
+            self.file.write(MAGIC)
+
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.thread = threading.Thread(target=self.write_loop, name='trajectory writer', daemon=True)
+        self.thread.start()
+
+    def record(self, step, agents):  # snapshot of an agent store, blocks only while max_pending snapshots wait
+        self.check()
+        self.queue.put((int(step), {name: np.array(getattr(agents, name)) for name in self.columns}))
+
+    def flush(self):  # write the snapshots recorded so far, partial chunk included, e.g. before a checkpoint
+        self.check()
+        done = threading.Event()
+        self.queue.put(done)
+        done.wait()
+        self.check()
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is None:
+            self.write_footer()
+        self.file.close()
+        self.check()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def check(self):  # errors of the writer thread surface in the simulation thread
+        if self.error is not None:
+            raise IOError('writing the trajectory failed') from self.error
+
+    def write_loop(self):
+        steps, snapshots, rows = [], [], 0
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            if isinstance(item, threading.Event):  # flush()
+                if steps and self.error is None:
+                    self.write_chunk(steps, snapshots)
+                    steps, snapshots, rows = [], [], 0
+                if self.error is None:
+                    self.file.flush()
+                item.set()
+                continue
+            if self.error is not None:
+                continue  # keep draining so that record() never blocks on a dead writer
+            step, snapshot = item
+            steps.append(step)
+            snapshots.append(snapshot)
+            rows += len(snapshot[self.columns[0]])
+            if len(steps) >= self.chunk_steps or rows >= self.chunk_rows:
+                self.write_chunk(steps, snapshots)
+                steps, snapshots, rows = [], [], 0
+        if steps and self.error is None:
+            self.write_chunk(steps, snapshots)
+
+    def write_chunk(self, steps, snapshots):
+        try:
+            offsets = np.cumsum([0] + [len(s[self.columns[0]]) for s in snapshots])
+            blocks, columns = [], {}
+            for name in self.columns:
+                values = np.concatenate([s[name] for s in snapshots])
+                blocks.append(zlib.compress(values.tobytes(), self.level))
+                columns[name] = [values.dtype.str, len(blocks[-1])]
+            header = json.dumps({'steps': steps, 'offsets': offsets.tolist(), 'columns': columns}).encode()
+
+            position = self.file.tell()
+            self.file.write(LENGTH.pack(len(header)) + header)
+            for block in blocks:
+                self.file.write(block)
+            for i, step in enumerate(steps):
+                self.index[step] = (position, int(offsets[i]), int(offsets[i + 1] - offsets[i]))
+        except Exception as e:
+            self.error = e
+
+    def write_footer(self):
+        footer = json.dumps({'columns': self.columns,
+                             'index': [[step] + list(entry) for step, entry in sorted(self.index.items())]}).encode()
+        self.file.write(footer + LENGTH.pack(len(footer)) + INDEX_MAGIC)
+        self.file.flush()
+
+
+class TrajectoryReader:
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        if self.file.read(len(MAGIC)) != MAGIC:
+            self.file.close()
+            raise ValueError('%s is not a trajectory file' % path)
+        self.columns = COLUMNS
+        self.index = {}
+        self.cached = (None, None)  # (chunk offset, decoded columns) of the last chunk read
+
+        size = self.file.seek(0, os.SEEK_END)
+        tail = len(INDEX_MAGIC) + LENGTH.size
+        self.file.seek(max(size - tail, 0))
+        end = self.file.read(tail)
+        if size >= len(MAGIC) + tail and end.endswith(INDEX_MAGIC):
+            length = LENGTH.unpack(end[:LENGTH.size])[0]
+            self.data_end = size - tail - length
+            self.file.seek(self.data_end)
+            footer = json.loads(self.file.read(length))
+            self.columns = tuple(footer['columns'])
+            self.index = {step: (offset, start, count) for step, offset, start, count in footer['index']}
+        else:
+            self.scan(size)
+        self.steps = np.array(sorted(self.index), dtype=np.int64)
+
+    def scan(self, size):  # rebuild the index from the chunk headers, dropping a partly written last chunk
+        position = len(MAGIC)
+        while position + LENGTH.size <= size:
+            self.file.seek(position)
+            length = LENGTH.unpack(self.file.read(LENGTH.size))[0]
+            try:
+                header = json.loads(self.file.read(length))
+            except ValueError:
+                break
+            end = position + LENGTH.size + length + sum(nbytes for _, nbytes in header['columns'].values())
+            if end > size:
+                break
+            self.columns = tuple(header['columns'])
+            offsets = header['offsets']
+            for i, step in enumerate(header['steps']):
+                self.index[step] = (position, offsets[i], offsets[i + 1] - offsets[i])
+            position = end
+        self.data_end = position
+
+    def __len__(self):
+        return len(self.steps)
+
+    def __contains__(self, step):
+        return step in self.index
+
+    def __iter__(self):  # (step, snapshot) in step order
+        for step in self.steps:
+            yield int(step), self.snapshot(step)
+
+    def snapshot(self, step, columns=None):  # dict of column arrays of all cells at the given step
+        if step not in self.index:
+            raise KeyError('step %d is not in the trajectory' % step)
+        offset, start, count = self.index[step]
+        chunk = self.read_chunk(offset, columns or self.columns)
+        return {name: chunk[name][start:start + count] for name in (columns or self.columns)}
+
+    def read_chunk(self, offset, columns):
+        cached_offset, decoded = self.cached
+        if cached_offset != offset:
+            decoded = {}
+        missing = [name for name in columns if name not in decoded]
+        if missing:
+            self.file.seek(offset)
+            length = LENGTH.unpack(self.file.read(LENGTH.size))[0]
+            header = json.loads(self.file.read(length))
+            position = offset + LENGTH.size + length
+            for name, (dtype, nbytes) in header['columns'].items():  # blocks follow in header order
+                if name in missing:
+                    self.file.seek(position)
+                    decoded[name] = np.frombuffer(zlib.decompress(self.file.read(nbytes)), dtype=dtype)
+                position += nbytes
+        self.cached = (offset, decoded)
+        return decoded
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()